@@ -80,6 +80,24 @@ class SceneConfig():
             logging.critical(msg)
             assert False, msg
 
+        # cache per-frame character deformations, so revisited frames (e.g. looping motions) are not recomputed
+        try:
+            self.cache_ad_deformations: bool = scene_cfg['CACHE_AD_DEFORMATIONS']
+            assert isinstance(self.cache_ad_deformations, bool), 'is not bool'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in CACHE_AD_DEFORMATIONS config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
+        # directory in which to save (and look for) per-character mesh and deformation caches
+        try:
+            self.ad_disk_cache_dir: Union[None, str] = scene_cfg['AD_DISK_CACHE_DIR']
+            assert isinstance(self.ad_disk_cache_dir, (NoneType, str)), 'type not NoneType or str'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in AD_DISK_CACHE_DIR config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
         # config files for characters, driving motions, and retargeting
         self.animated_characters: List[Tuple[CharacterConfig, RetargetConfig, MotionConfig]] = []
 
@@ -245,6 +263,16 @@ class ControllerConfig():
             logging.critical(msg)
             assert False, msg
 
+        # number of initial frames used to compute a palette shared by all frames of a .gif (only use in video_render mode with .gif)
+        try:
+            self.output_gif_palette_sample_frames: int = controller_cfg['OUTPUT_GIF_PALETTE_SAMPLE_FRAMES']
+            assert isinstance(self.output_gif_palette_sample_frames, int), 'type is not int'
+            assert self.output_gif_palette_sample_frames >= 0, 'must be >= 0'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in OUTPUT_GIF_PALETTE_SAMPLE_FRAMES config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
 
 class CharacterConfig():
 
@@ -322,6 +350,26 @@ class CharacterConfig():
             logging.critical(msg)
             assert False, msg
 
+        # validate mesh interior grid size, if present
+        try:
+            self.mesh_interior_grid_size: int = char_cfg.get('mesh_interior_grid_size', 40)
+            assert isinstance(self.mesh_interior_grid_size, int), 'type not int'
+            assert self.mesh_interior_grid_size >= 2, 'must be >= 2'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in character mesh_interior_grid_size config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
+        # validate joint segmentation method, if present
+        try:
+            self.joint_segmentation_method: str = char_cfg.get('joint_segmentation_method', 'bfs')
+            assert self.joint_segmentation_method in ('bfs', 'distance_transform'), \
+                f"must be 'bfs' or 'distance_transform', found {self.joint_segmentation_method}"
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in character joint_segmentation_method config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
         # validate mask and texture files
         try:
             self.mask_p: Path = character_cfg_p.parent / 'mask.png'
@@ -5,9 +5,12 @@
 """ Video Render Controller Class Module """
 
 from __future__ import annotations
+import ctypes
 import time
 import logging
-from typing import List
+import queue
+import threading
+from typing import BinaryIO, List, Optional
 from pathlib import Path
 from abc import abstractmethod
 import numpy as np
@@ -28,6 +31,8 @@ NoneType = type(None)  # for type checking below
 class VideoRenderController(Controller):
     """ Video Render Controller is used to non-interactively generate a video file """
 
+    PBO_COUNT = 2  # number of pixel buffer objects frames are asynchronously read back into
+
     def __init__(self, cfg: ControllerConfig, scene: Scene, view: View) -> None:
         super().__init__(cfg, scene)
 
@@ -48,7 +53,17 @@ class VideoRenderController(Controller):
 
         self.video_writer: VideoWriter = VideoWriter.create_video_writer(self)
 
-        self.frame_data = np.empty([self.video_height, self.video_width, 4], dtype='uint8')  # 4 for RGBA
+        # ring of pixel buffer objects. Each frame is read back into the next one without waiting on the GPU,
+        # and is mapped and sent to the video writer only once the following frame has been rendered
+        self._frame_nbytes: int = self.video_height * self.video_width * 4  # 4 for RGBA
+        self._pbos: npt.NDArray[np.uint32] = np.atleast_1d(GL.glGenBuffers(self.PBO_COUNT))
+        for pbo in self._pbos:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, self._frame_nbytes, None, GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self._pbo_idx: int = 0               # pbo the next frame will be read into
+        self._pending_frame_count: int = 0   # frames read into pbos but not yet sent to the video writer
+        self._fallback_frame: Optional[npt.NDArray[np.uint8]] = None  # used only if a pbo cannot be mapped
 
         self.progress_bar = tqdm(total=self.frames_left_to_render)
 
@@ -64,8 +79,8 @@ class VideoRenderController(Controller):
         for child in self.scene.get_children():
             if not isinstance(child, AnimatedDrawing):
                 continue
-            max_frames = max(max_frames, child.retargeter.bvh.frame_max_num)
-            frame_time.append(child.retargeter.bvh.frame_time)
+            max_frames = max(max_frames, child.retargeter.frame_max_num)
+            frame_time.append(child.retargeter.frame_time)
 
         if not all(x == frame_time[0] for x in frame_time):
             msg = f'frame time of BVH files don\'t match. Using first value: {frame_time[0]}'
@@ -78,7 +93,8 @@ class VideoRenderController(Controller):
         self.run_loop_start_time = time.time()
 
     def _is_run_over(self) -> bool:
-        return self.frames_left_to_render == 0
+        # stop early if the video writer has failed; cleanup then releases resources and raises its error
+        return self.frames_left_to_render == 0 or self.video_writer.has_failed()
 
     def _start_run_loop_iteration(self) -> None:
         self.view.clear_window()
@@ -96,18 +112,55 @@ class VideoRenderController(Controller):
         """ ignore all user input when rendering video file """
 
     def _finish_run_loop_iteration(self) -> None:
-        # get pixel values from the frame buffer, send them to the video writer
+        # start reading pixel values from the frame buffer into the next pbo; this returns without waiting for the transfer
         GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, 0)
-        GL.glReadPixels(0, 0, self.video_width, self.video_height, GL.GL_BGRA, GL.GL_UNSIGNED_BYTE, self.frame_data)
-        self.video_writer.process_frame(self.frame_data[::-1, :, :].copy())
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self._pbos[self._pbo_idx])
+        GL.glReadPixels(0, 0, self.video_width, self.video_height, GL.GL_BGRA, GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self._pbo_idx = (self._pbo_idx + 1) % self.PBO_COUNT
+        self._pending_frame_count += 1
+
+        # once every pbo is in use, send the oldest frame to the video writer so its pbo is free for the next frame
+        if self._pending_frame_count == self.PBO_COUNT:
+            self._write_oldest_pending_frame()
 
         # update our counts and progress_bar
         self.frames_left_to_render -= 1
         self.frames_rendered += 1
         self.progress_bar.update(1)
 
+    def _write_oldest_pending_frame(self) -> None:
+        """ Maps the pbo holding the oldest frame not yet written and passes its pixels to the video writer. """
+        pbo_idx = (self._pbo_idx - self._pending_frame_count) % self.PBO_COUNT
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self._pbos[pbo_idx])
+        ptr = GL.glMapBufferRange(GL.GL_PIXEL_PACK_BUFFER, 0, self._frame_nbytes, GL.GL_MAP_READ_BIT)
+        if ptr:
+            frame = np.ctypeslib.as_array(ctypes.cast(ptr, ctypes.POINTER(ctypes.c_uint8)), shape=(self._frame_nbytes,))
+        else:
+            # mapping failed: copy the pbo's contents into a frame buffer instead. The framebuffer itself can't be
+            # re-read, as it already holds a later frame
+            logging.warning('Could not map pixel buffer object, copying frame instead')
+            if self._fallback_frame is None:
+                self._fallback_frame = np.empty(self._frame_nbytes, dtype=np.uint8)
+            GL.glGetBufferSubData(GL.GL_PIXEL_PACK_BUFFER, 0, self._frame_nbytes, self._fallback_frame)
+            frame = self._fallback_frame
+
+        # OpenGL's origin is the bottom left, so flip rows with a view rather than a copy
+        self.video_writer.process_frame(frame.reshape([self.video_height, self.video_width, 4])[::-1])
+
+        if ptr:
+            GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self._pending_frame_count -= 1
+
     def _cleanup_after_run_loop(self) -> None:
         logging.info(f'Rendered {self.frames_rendered} frames in {time.time()-self.run_loop_start_time} seconds.')
+
+        # write frames still waiting within pbos, then release them
+        while self._pending_frame_count > 0:
+            self._write_oldest_pending_frame()
+        GL.glDeleteBuffers(self.PBO_COUNT, self._pbos)
+
         self.view.cleanup()
 
         _time = time.time()
@@ -123,7 +176,10 @@ class VideoWriter():
 
     @abstractmethod
     def process_frame(self, frame: npt.NDArray[np.uint8]) -> None:
-        """ Subclass must specify how to handle each frame of data received. """
+        """
+        Subclass must specify how to handle each frame of data received.
+        frame is a [H, W, 4] BGRA view that is only valid during this call; copy it if it must be kept.
+        """
         pass
 
     @abstractmethod
@@ -131,6 +187,10 @@ class VideoWriter():
         """ Subclass must specify how to finish up after all frames have been received. """
         pass
 
+    def has_failed(self) -> bool:
+        """ Returns True if the writer can no longer write frames. Its error is raised by cleanup(). """
+        return False
+
     @staticmethod
     def create_video_writer(controller: VideoRenderController) -> VideoWriter:
 
@@ -143,18 +203,92 @@ class VideoWriter():
         logging.info(msg)
         print(msg)
 
+        video_writer: VideoWriter
         if output_p.suffix == '.gif':
-            return GIFWriter(controller)
+            video_writer = GIFWriter(controller)
         elif output_p.suffix == '.mp4':
-            return MP4Writer(controller)
+            video_writer = MP4Writer(controller)
         else:
             msg = f'Unsupported output video file extension ({output_p.suffix}). Only .gif and .mp4 are supported.'
             logging.critical(msg)
             assert False, msg
 
+        # encode on a separate thread so rendering the next frame overlaps with encoding this one
+        return ThreadedVideoWriter(video_writer, controller.video_width, controller.video_height)
+
+
+class ThreadedVideoWriter(VideoWriter):
+    """
+    Wraps another VideoWriter, calling its process_frame() on a worker thread.
+    Frames are copied into a fixed pool of buffers; when all are waiting to be encoded, process_frame() blocks until one frees up.
+    If the wrapped writer raises, later frames are discarded, has_failed() returns True, and cleanup() raises the error.
+    """
+
+    QUEUE_SIZE = 4  # maximum number of frames waiting to be encoded
+
+    def __init__(self, video_writer: VideoWriter, video_width: int, video_height: int) -> None:
+        self.video_writer: VideoWriter = video_writer
+
+        # buffers not currently holding a frame, and frames waiting to be encoded. None signals the worker to stop.
+        self._free_frames: queue.Queue[npt.NDArray[np.uint8]] = queue.Queue()
+        for _ in range(self.QUEUE_SIZE):
+            self._free_frames.put(np.empty([video_height, video_width, 4], dtype=np.uint8))
+        self._queued_frames: queue.Queue[Optional[npt.NDArray[np.uint8]]] = queue.Queue()
+
+        self._error: Optional[Exception] = None  # first exception raised by the wrapped writer, if any
+
+        self._worker = threading.Thread(target=self._encode_frames, name='VideoWriter', daemon=True)
+        self._worker.start()
+
+    def _encode_frames(self) -> None:
+        """ Worker loop: passes queued frames to the wrapped writer, returning their buffers to the pool. """
+        while True:
+            frame = self._queued_frames.get()
+            if frame is None:
+                return
+            try:
+                if self._error is None:  # after an error, keep draining so process_frame() never blocks forever
+                    self.video_writer.process_frame(frame)
+            except Exception as e:
+                logging.critical(f'Error encoding video frame: {e}', exc_info=True)
+                self._error = e
+            finally:
+                self._free_frames.put(frame)
+
+    def has_failed(self) -> bool:
+        return self._error is not None
+
+    def process_frame(self, frame: npt.NDArray[np.uint8]) -> None:
+        """ Copies frame into a free buffer and queues it for the worker, waiting for a buffer if none are free. """
+        if self._error is not None:
+            return  # nothing more can be written; the error is raised by cleanup()
+        buffer = self._free_frames.get()
+        np.copyto(buffer, frame)
+        self._queued_frames.put(buffer)
+
+    def cleanup(self) -> None:
+        """
+        Waits for all queued frames to be encoded, then cleans up the wrapped writer, even if it failed.
+        If the wrapped writer raised while encoding, logs the error and fails.
+        """
+        self._queued_frames.put(None)
+        self._worker.join()
+        try:
+            self.video_writer.cleanup()
+        finally:
+            if self._error is not None:
+                msg = f'Error encoding video frame: {self._error}'
+                logging.critical(msg)
+                assert False, msg
+
 
 class GIFWriter(VideoWriter):
-    """ Video writer for creating transparent, animated GIFs with Pillow """
+    """
+    Video writer for creating transparent, animated GIFs with Pillow.
+    Frames are quantized and appended to the file as they arrive, so memory use does not grow with the length of the video.
+    """
+
+    TRANSPARENT_IDX = 255  # palette index reserved for fully transparent pixels; quantized colors use the remaining 255
 
     def __init__(self, controller: VideoRenderController) -> None:
         assert isinstance(controller.cfg.output_video_path, str)  # for static analysis
@@ -166,19 +300,101 @@ class GIFWriter(VideoWriter):
             logging.warn(msg)
             self.duration = 20
 
-        self.frames: List[npt.NDArray[np.uint8]] = []
+        # if nonzero, all frames share one palette computed from this many initial frames, which are held until it is computed
+        self.palette_sample_frames: int = controller.cfg.output_gif_palette_sample_frames
+        self.sample_frames: List[npt.NDArray[np.uint8]] = []
+        self.global_palette: Optional[npt.NDArray[np.uint8]] = None  # [255, 3] RGB colors
+
+        self.output_f: Optional[BinaryIO] = None  # opened when the first frame is written
 
     def process_frame(self, frame: npt.NDArray[np.uint8]) -> None:
-        """ Reorder channels and save frames as they arrive"""
-        self.frames.append(cv2.cvtColor(frame, cv2.COLOR_BGRA2RGBA).astype(np.uint8))
+        """ Reorder channels, then quantize and append each frame to the file as it arrives """
+        frame_rgba = cv2.cvtColor(frame, cv2.COLOR_BGRA2RGBA)
+
+        if self.palette_sample_frames == 0:
+            self._write_frame(frame_rgba)
+            return
+
+        if self.global_palette is None:
+            self.sample_frames.append(frame_rgba)
+            if len(self.sample_frames) == self.palette_sample_frames:
+                self._write_sample_frames()
+            return
+
+        self._write_frame(frame_rgba)
 
     def cleanup(self) -> None:
-        """ Write all frames to output path specified."""
+        """ Write any frames held for palette sampling, then finish the file. """
+        if self.sample_frames:
+            self._write_sample_frames()
+
+        if self.output_f is None:
+            logging.warning(f'No frames received, not writing {self.output_p.resolve()}')
+            return
+
+        self.output_f.write(b';')  # gif trailer
+        self.output_f.close()
+        self.output_f = None
+
+    def _write_sample_frames(self) -> None:
+        """ Compute the global palette from the opaque pixels of the sample frames, then write and release them. """
         from PIL import Image
-        self.output_p.parent.mkdir(exist_ok=True, parents=True)
+        opaque_pixels = np.concatenate([frame[frame[:, :, 3] != 0][:, :3] for frame in self.sample_frames])
+        if opaque_pixels.shape[0] == 0:
+            opaque_pixels = np.zeros([1, 3], dtype=np.uint8)
+        palette_im = Image.fromarray(opaque_pixels.reshape([-1, 1, 3])).quantize(colors=self.TRANSPARENT_IDX)
+        self.global_palette = np.array(palette_im.getpalette()[:3 * self.TRANSPARENT_IDX], dtype=np.uint8).reshape([-1, 3])
+
+        for frame_rgba in self.sample_frames:
+            self._write_frame(frame_rgba)
+        self.sample_frames = []
+
+    def _write_frame(self, frame_rgba: npt.NDArray[np.uint8]) -> None:
+        """ Quantize frame to the global palette, or its own if there is none, and append it to the file. """
+        from PIL import Image, GifImagePlugin
+
+        # quantize to at most 255 colors, then mark transparent pixels with the reserved palette index
+        frame_rgb = Image.fromarray(np.ascontiguousarray(frame_rgba[:, :, :3]))
+        if self.global_palette is None:
+            quantized = frame_rgb.quantize(colors=self.TRANSPARENT_IDX)
+        else:
+            palette_im = Image.new('P', (1, 1))
+            palette_im.putpalette(self.global_palette.tobytes())
+            quantized = frame_rgb.quantize(palette=palette_im, dither=Image.Dither.NONE)
+        frame_idxs = np.array(quantized, dtype=np.uint8)
+        frame_idxs[frame_rgba[:, :, 3] == 0] = self.TRANSPARENT_IDX
+
+        palette = np.zeros([256, 3], dtype=np.uint8)
+        quantized_palette = quantized.getpalette()[:3 * self.TRANSPARENT_IDX]
+        palette[:len(quantized_palette) // 3] = np.array(quantized_palette, dtype=np.uint8).reshape([-1, 3])
+
+        if self.output_f is None:
+            self._write_header(frame_idxs.shape[1], frame_idxs.shape[0], palette)
+
+        # previous frame is cleared to transparent (disposal 2), so only the region containing opaque pixels is needed
+        opaque_rows = np.flatnonzero(frame_idxs.min(axis=1) != self.TRANSPARENT_IDX)
+        opaque_cols = np.flatnonzero(frame_idxs.min(axis=0) != self.TRANSPARENT_IDX)
+        if opaque_rows.size == 0:
+            opaque_rows, opaque_cols = np.array([0]), np.array([0])
+        y0, y1, x0, x1 = opaque_rows[0], opaque_rows[-1] + 1, opaque_cols[0], opaque_cols[-1] + 1
+
+        frame_im = Image.frombytes('P', (x1 - x0, y1 - y0), np.ascontiguousarray(frame_idxs[y0:y1, x0:x1]).tobytes())
+        frame_im.putpalette(palette.tobytes())
+        assert self.output_f is not None  # for static analysis
+        for data in GifImagePlugin.getdata(frame_im, offset=(int(x0), int(y0)), duration=self.duration, disposal=2,
+                                           transparency=self.TRANSPARENT_IDX, include_color_table=self.global_palette is None):
+            self.output_f.write(data)
+
+    def _write_header(self, width: int, height: int, palette: npt.NDArray[np.uint8]) -> None:
+        """ Open the output file and write the gif header, global color table, and looping extension. """
         logging.info(f'VideoWriter will write to {self.output_p.resolve()}')
-        ims = [Image.fromarray(a_frame) for a_frame in self.frames]
-        ims[0].save(self.output_p, save_all=True, append_images=ims[1:], duration=self.duration, disposal=2, loop=0)
+        self.output_p.parent.mkdir(exist_ok=True, parents=True)
+        self.output_f = open(self.output_p, 'wb')
+
+        self.output_f.write(b'GIF89a' + width.to_bytes(2, 'little') + height.to_bytes(2, 'little'))
+        self.output_f.write(bytes([0xF7, self.TRANSPARENT_IDX, 0]))  # 256 entry global color table, background, aspect ratio
+        self.output_f.write(palette.tobytes())
+        self.output_f.write(b'!\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00')  # loop forever
 
 
 class MP4Writer(VideoWriter):
@@ -4,24 +4,25 @@
 
 import logging
 import ctypes
+import hashlib
 import heapq
 import math
+import os
 import time
-from typing import Dict, List, Tuple, Optional, TypedDict, DefaultDict
-from collections import defaultdict
+from typing import Dict, List, Tuple, Optional, TypedDict
 from pathlib import Path
 
 import cv2
 import numpy as np
 import numpy.typing as npt
 from skimage import measure
-from shapely import geometry
 from OpenGL import GL
 
+from scipy import ndimage
 from scipy.spatial import Delaunay
 from animated_drawings.model.transform import Transform
 from animated_drawings.model.time_manager import TimeManager
-from animated_drawings.model.retargeter import Retargeter
+from animated_drawings.model.retargeter import Retargeter, RetargetedMotion
 from animated_drawings.model.arap import ARAP
 from animated_drawings.model.joint import Joint
 from animated_drawings.model.quaternions import Quaternions
@@ -34,6 +35,14 @@ class AnimatedDrawingMesh(TypedDict):
     triangles: List[npt.NDArray[np.int32]]
 
 
+class AnimatedDrawingFrame(TypedDict):
+    """ Everything update() computes for a single BVH frame. Used to cache deformations. """
+    vertices_xyz: npt.NDArray[np.float32]
+    indices: npt.NDArray[np.int32]
+    root_position: npt.NDArray[np.float32]
+    joint_rotations: npt.NDArray[np.float32]
+
+
 class AnimatedDrawingsJoint(Joint):
     """ Joints within Animated Drawings Rig."""
 
@@ -92,8 +101,19 @@ class AnimatedDrawingRig(Transform):
 
         # attach root joint
         self.root_joint = joints_d['root']
+        self.joints: List[AnimatedDrawingsJoint] = list(joints_d.values())
+        self.joint_names: List[str] = list(joints_d.keys())
         self.add_child(self.root_joint)
 
+        # joints paired with their index in self.joints, parents before children, in the order orientations are applied
+        joint_to_idx: Dict[AnimatedDrawingsJoint, int] = {joint: idx for idx, joint in enumerate(self.joints)}
+        self._pose_order: List[Tuple[AnimatedDrawingsJoint, int]] = []
+        stack: List[AnimatedDrawingsJoint] = [self.root_joint]
+        while stack:
+            joint = stack.pop()
+            self._pose_order.append((joint, joint_to_idx[joint]))
+            stack.extend(c for c in reversed(joint.get_children()) if isinstance(c, AnimatedDrawingsJoint))
+
         # cache for later
         self.joint_count = joints_d['root'].joint_count()
 
@@ -103,10 +123,38 @@ class AnimatedDrawingRig(Transform):
         self._is_opengl_initialized: bool = False
         self._vertex_buffer_dirty_bit: bool = True
 
-    def set_global_orientations(self, bvh_frame_orientations: Dict[str, float]) -> None:
-        """ Applies orientation from bvh_frame_orientation to the rig. """
+    def set_global_orientations(self, bvh_frame_orientations: npt.NDArray[np.float32]) -> None:
+        """
+        Applies orientation from bvh_frame_orientation to the rig.
+        bvh_frame_orientations is a [J] array ordered as self.joints; NaN entries leave that joint's bone unchanged.
+        """
+        for joint, idx in self._pose_order:
+            orientation = float(bvh_frame_orientations[idx])
+            if math.isnan(orientation):
+                continue
+
+            theta: float = math.radians(orientation - joint.starting_theta)
+            joint.current_theta = theta
+
+            parent = joint.get_parent()
+            assert isinstance(parent, AnimatedDrawingsJoint)
+            if hasattr(parent, 'current_theta'):
+                theta = theta - parent.current_theta
+
+            # rotation about the z axis, written straight into the joint's rotation matrix
+            rotation_q = Quaternions(np.array([math.cos(theta / 2), 0.0, 0.0, math.sin(theta / 2)]), normalize=False)
+            parent.set_rotation(rotation_q)
 
-        self._set_global_orientations(self.root_joint, bvh_frame_orientations)
+        self._vertex_buffer_dirty_bit = True
+
+    def get_joint_rotations(self) -> npt.NDArray[np.float32]:
+        """ Returns [J, 4, 4] array containing the rotation matrix of each joint in the rig. """
+        return np.stack([joint.get_rotation_matrix() for joint in self.joints])
+
+    def set_joint_rotations(self, joint_rotations: npt.NDArray[np.float32]) -> None:
+        """ Restores joint rotations previously returned by get_joint_rotations(). """
+        for joint, rotate_m in zip(self.joints, joint_rotations):
+            joint.set_rotation_matrix(rotate_m)
         self._vertex_buffer_dirty_bit = True
 
     def get_joints_2D_positions(self) -> npt.NDArray[np.float32]:
@@ -119,8 +167,8 @@ class AnimatedDrawingRig(Transform):
             parent = self.root_joint
 
         for c in parent.get_children():
-            p1 = c.get_world_position()
-            p2 = parent.get_world_position()
+            p1 = c.get_world_position(copy=False)
+            p2 = parent.get_world_position(copy=False)
 
             self.vertices[pointer[0], 0:3] = p1
             self.vertices[pointer[0] + 1, 0:3] = p2
@@ -167,26 +215,6 @@ class AnimatedDrawingRig(Transform):
 
         self._vertex_buffer_dirty_bit = False
 
-    def _set_global_orientations(self, joint: AnimatedDrawingsJoint, bvh_orientations: Dict[str, float]) -> None:
-        if joint.name in bvh_orientations.keys():
-
-            theta: float = bvh_orientations[str(joint.name)] - joint.starting_theta
-            theta = np.radians(theta)
-            joint.current_theta = theta
-
-            parent = joint.get_parent()
-            assert isinstance(parent, AnimatedDrawingsJoint)
-            if hasattr(parent, 'current_theta'):
-                theta = theta - parent.current_theta
-
-            rotation_q = Quaternions.from_angle_axis(np.array([theta]), axes=Vectors([0.0, 0.0, 1.0]))
-            parent.set_rotation(rotation_q)
-            parent.update_transforms()
-
-        for c in joint.get_children():
-            if isinstance(c, AnimatedDrawingsJoint):
-                self._set_global_orientations(c, bvh_orientations)
-
     def _draw(self, **kwargs):
         if not kwargs['viewer_cfg'].draw_ad_rig:
             return
@@ -219,9 +247,21 @@ class AnimatedDrawing(Transform, TimeManager):
 
     After initializing the object, the retarger must be initialized by calling initialize_retarger_bvh().
     Afterwars, only the update() method needs to be called.
+
+    If cache_deformations is True, the results of update() are cached for each BVH frame.
+    Later updates landing on an already-visited frame (e.g. when the motion loops) then skip retargeting, rig posing, and ARAP.
+
+    If disk_cache_dir is specified, the mesh, joint->triangle mapping, retargeted motion, and results of update() for every BVH frame are saved within it.
+    The file is named using a hash of the character's mask, texture, and BVH file contents and the three configs.
+    Creating the same AnimatedDrawing again loads this file and skips mesh generation, segmentation, BVH loading, retargeting,
+    building the ARAP solver, and all per-frame work.
     """
 
-    def __init__(self, char_cfg: CharacterConfig, retarget_cfg: RetargetConfig, motion_cfg: MotionConfig):
+    DISK_CACHE_VERSION = 2  # increment when the contents of the disk cache change
+
+    def __init__(self, char_cfg: CharacterConfig, retarget_cfg: RetargetConfig, motion_cfg: MotionConfig,
+                 cache_deformations: bool = False, disk_cache_dir: Optional[str] = None,
+                 motion_cache: Optional[Dict[str, RetargetedMotion]] = None):
         super().__init__()
 
         self.char_cfg: CharacterConfig = char_cfg
@@ -230,6 +270,13 @@ class AnimatedDrawing(Transform, TimeManager):
 
         self.img_dim: int = self.char_cfg.img_dim
 
+        # find the disk cache file before the retarget config is modified, and load it if it exists
+        self.disk_cache_p: Optional[Path] = None
+        disk_cache: Optional[Dict[str, npt.NDArray[np.float32]]] = None
+        if disk_cache_dir is not None:
+            self.disk_cache_p = Path(disk_cache_dir) / f'{self._compute_disk_cache_key(char_cfg, retarget_cfg, motion_cfg)}.npz'
+            disk_cache = self._load_disk_cache()
+
         # load mask and pad to square
         self.mask: npt.NDArray[np.uint8] = self._load_mask()
 
@@ -238,7 +285,10 @@ class AnimatedDrawing(Transform, TimeManager):
 
         # generate the mesh
         self.mesh: AnimatedDrawingMesh
-        self._generate_mesh()
+        if disk_cache is not None:
+            self.mesh = {'vertices': disk_cache['mesh_vertices'], 'triangles': list(disk_cache['mesh_triangles'])}
+        else:
+            self._generate_mesh()
 
         self.rig = AnimatedDrawingRig(self.char_cfg)
         self.add_child(self.rig)
@@ -247,21 +297,50 @@ class AnimatedDrawing(Transform, TimeManager):
         self._modify_retargeting_cfg_for_character()
 
         self.joint_to_tri_v_idx:  Dict[str, npt.NDArray[np.int32]]
-        self._initialize_joint_to_triangles_dict()
+        if disk_cache is not None:
+            self.joint_to_tri_v_idx = {key[len('joint_to_tri_v_idx/'):]: val for key, val in disk_cache.items() if key.startswith('joint_to_tri_v_idx/')}
+        else:
+            self._initialize_joint_to_triangles_dict()
 
         self.indices: npt.NDArray[np.int32] = np.stack(self.mesh['triangles']).flatten()  # order in which to render triangles
 
         self.retargeter: Retargeter
-        self._initialize_retargeter_bvh(motion_cfg, retarget_cfg)
-
-        # initialize arap solver with original joint positions
-        self.arap = ARAP(self.rig.get_joints_2D_positions(), self.mesh['triangles'], self.mesh['vertices'])
+        self._depth_driver_idxs: npt.NDArray[np.int32]
+        self._depth_driver_weights: npt.NDArray[np.float64]
+        if disk_cache is not None:
+            self.retargeter = Retargeter(motion_cfg, retarget_cfg, load_motion=False, motion_cache=motion_cache)
+            self.retargeter.set_retargeted_data(float(disk_cache['frame_time']), disk_cache['char_joint_orientations'],
+                                                disk_cache['bvh_joint_depths'], disk_cache['char_root_positions'])
+            self._depth_driver_idxs = disk_cache['depth_driver_idxs'].astype(np.int32)
+            self._depth_driver_weights = disk_cache['depth_driver_weights'].astype(np.float64)
+        else:
+            self._initialize_retargeter_bvh(motion_cfg, retarget_cfg, motion_cache)
+
+        # arap solver is built with the original joint positions the first time a frame must be computed, see the arap property
+        self._arap: Optional[ARAP] = None
+        self._arap_rest_joint_positions: npt.NDArray[np.float32] = self.rig.get_joints_2D_positions()
 
         self.vertices: npt.NDArray[np.float32]
         self._initialize_vertices()
 
         self._is_opengl_initialized: bool = False
         self._vertex_buffer_dirty_bit: bool = True
+        self._index_buffer_dirty_bit: bool = True
+        self._index_buffer_nbytes: int = 0  # size of the currently allocated element buffer
+
+        # render order of bodypart groups as ((group idx, is in front of plane), ...), and the indices built for each order seen
+        self._render_order: Optional[Tuple[Tuple[int, bool], ...]] = None
+        self._render_order_to_indices: Dict[Tuple[Tuple[int, bool], ...], npt.NDArray[np.int32]] = {}
+
+        # maps bvh frame index to the posed character at that frame, if caching is enabled
+        self.frame_cache: Optional[Dict[int, AnimatedDrawingFrame]] = {} if cache_deformations or disk_cache_dir is not None else None
+
+        # fill the frame cache from disk, or compute every frame and save them to disk
+        if disk_cache is not None:
+            self._load_disk_cached_frames(disk_cache)
+        elif self.disk_cache_p is not None:
+            self.precompute_frames()
+            self._save_disk_cache()
 
         # pose the animated drawing using the first frame of the bvh
         self.update()
@@ -310,11 +389,12 @@ class AnimatedDrawing(Transform, TimeManager):
                 logging.critical(msg)
                 assert False, msg
 
-    def _initialize_retargeter_bvh(self, motion_cfg: MotionConfig, retarget_cfg: RetargetConfig):
+    def _initialize_retargeter_bvh(self, motion_cfg: MotionConfig, retarget_cfg: RetargetConfig,
+                                   motion_cache: Optional[Dict[str, RetargetedMotion]] = None):
         """ Initializes the retargeter used to drive the animated character.  """
 
         # initialize retargeter
-        self.retargeter = Retargeter(motion_cfg, retarget_cfg)
+        self.retargeter = Retargeter(motion_cfg, retarget_cfg, motion_cache=motion_cache)
 
         # validate the motion and retarget config files, now that we know char/bvh joint names
         char_joint_names: List[str] = self.rig.root_joint.get_chain_joint_names()
@@ -343,8 +423,8 @@ class AnimatedDrawing(Transform, TimeManager):
         b_joint_groups: List[List[str]] = char_bvh_root_offset['bvh_joints']
         for b_joint_group in b_joint_groups:
             while len(b_joint_group) >= 2:
-                b_dist_joint = self.retargeter.bvh.root_joint.get_transform_by_name(b_joint_group[1])
-                b_prox_joint = self.retargeter.bvh.root_joint.get_transform_by_name(b_joint_group[0])
+                b_dist_joint = self.retargeter.bvh.skeleton.get_joint_by_name(b_joint_group[1])
+                b_prox_joint = self.retargeter.bvh.skeleton.get_joint_by_name(b_joint_group[0])
                 assert isinstance(b_dist_joint, Joint)
                 assert isinstance(b_prox_joint, Joint)
                 b_dist_joint_pos = b_dist_joint.get_world_position()
@@ -360,6 +440,27 @@ class AnimatedDrawing(Transform, TimeManager):
         # compute the necessary orienations
         for char_joint_name, (bvh_prox_joint_name, bvh_dist_joint_name) in self.retarget_cfg.char_joint_bvh_joints_mapping.items():
             self.retargeter.compute_orientations(bvh_prox_joint_name, bvh_dist_joint_name, char_joint_name)
+        self.retargeter.set_char_joint_order(self.rig.joint_names)
+
+        # [G, K] weights averaging the depths of each bodypart group's depth drivers, and the K bvh joint indices they apply to
+        driver_names: List[str] = sorted({name for group in self.retarget_cfg.char_bodypart_groups for name in group['bvh_depth_drivers']})
+        for driver_name in driver_names:
+            if driver_name not in self.retargeter.bvh_joint_to_projection_depth:
+                msg = f'bvh_depth_driver {driver_name} is not within any bvh_projection_bodypart_group'
+                logging.critical(msg)
+                assert False, msg
+        self._depth_driver_idxs = np.array([bvh_joint_names.index(name) for name in driver_names], dtype=np.int32)
+        self._depth_driver_weights = np.zeros([len(self.retarget_cfg.char_bodypart_groups), len(driver_names)])
+        for group_idx, group in enumerate(self.retarget_cfg.char_bodypart_groups):
+            for driver_name in group['bvh_depth_drivers']:
+                self._depth_driver_weights[group_idx, driver_names.index(driver_name)] += 1.0 / len(group['bvh_depth_drivers'])
+
+    @property
+    def arap(self) -> ARAP:
+        """ The ARAP solver used to deform the mesh. Built on first use, so characters whose frames all come from a cache never build it. """
+        if self._arap is None:
+            self._arap = ARAP(self._arap_rest_joint_positions, self.mesh['triangles'], self.mesh['vertices'])
+        return self._arap
 
     def update(self):
         """
@@ -368,17 +469,18 @@ class AnimatedDrawing(Transform, TimeManager):
         Orientations are passed to rig to calculate new joint positions.
         The updated joint positions are passed into the ARAP module, which computes the new vertex locations.
         The new vertex locations are stored and the dirty bit is set.
+        If the deformation cache is enabled and this frame has been seen before, the cached results are used instead.
         """
 
-        # get retargeted motion data
-        frame_orientations: Dict[str, float]
-        joint_depths: Dict[str, float]
-        root_position: npt.NDArray[np.float32]
-        frame_orientations, joint_depths, root_position = self.retargeter.get_retargeted_frame_data(self.get_time())
+        frame_idx: int = self.retargeter.get_frame_idx(self.get_time())
+        if self.frame_cache is not None and frame_idx in self.frame_cache:
+            self._apply_cached_frame(self.frame_cache[frame_idx])
+            return
 
-        # update the rig's root position and reorient all of its joints
-        self.rig.root_joint.set_position(root_position)
-        self.rig.set_global_orientations(frame_orientations)
+        # pose the rig using retargeted motion data
+        joint_depths: npt.NDArray[np.float32]
+        root_position: npt.NDArray[np.float32]
+        joint_depths, root_position = self._pose_rig(self.get_time())
 
         # using new joint positions, calculate new mesh vertex xy positions
         control_points: npt.NDArray[np.float32] = self.rig.get_joints_2D_positions() - root_position[:2]
@@ -392,49 +494,235 @@ class AnimatedDrawing(Transform, TimeManager):
         # using joint depths, determine the correct order in which to render the character
         self._set_draw_indices(joint_depths)
 
-    def _set_draw_indices(self, joint_depths: Dict[str, float]):
+        if self.frame_cache is not None:
+            self.frame_cache[frame_idx] = {
+                'vertices_xyz': self.vertices[:, :3].copy(),
+                'indices': self.indices,
+                'root_position': root_position,
+                'joint_rotations': self.rig.get_joint_rotations(),
+            }
 
-        # sort segmentation groups by decreasing depth_driver's distance to camera
-        _bodypart_render_order: List[Tuple[int, np.float32]] = []
-        for idx, bodypart_group_dict in enumerate(self.retarget_cfg.char_bodypart_groups):
-            bodypart_depth: np.float32 = np.mean([joint_depths[joint_name] for joint_name in bodypart_group_dict['bvh_depth_drivers']])
-            _bodypart_render_order.append((idx, bodypart_depth))
-        _bodypart_render_order.sort(key=lambda x: float(x[1]))
-
-        # Add vertices belonging to joints in each segment group in the order they will be rendered
-        indices: List[npt.NDArray[np.int32]] = []
-        for idx, dist in _bodypart_render_order:
-            intra_bodypart_render_order = 1 if dist > 0 else -1  # if depth driver is behind plane, render bodyparts in reverse order
-            for joint_name in self.retarget_cfg.char_bodypart_groups[idx]['char_joints'][::intra_bodypart_render_order]:
-                indices.append(self.joint_to_tri_v_idx.get(joint_name, np.array([], dtype=np.int32)))
-        self.indices = np.hstack(indices)
-
-    def _initialize_joint_to_triangles_dict(self) -> None:  # noqa: C901
+    def precompute_frames(self) -> None:
         """
-        Uses BFS to find and return the closest joint bone (line segment between joint and parent) to each triangle centroid.
+        Computes the results of update() for every BVH frame and stores them within the frame cache.
+        Rather than solving ARAP once per frame, the control points of all frames are solved at once with ARAP.solve_batch().
         """
-        shortest_distance = np.full(self.mask.shape, 1 << 12, dtype=np.int32)  # to nearest joint
-        closest_joint_idx = np.full(self.mask.shape, -1, dtype=np.int8)  # track joint idx nearest each point
+        if self.frame_cache is None:
+            self.frame_cache = {}
+
+        frame_time: float = self.retargeter.frame_time
+        frames: List[AnimatedDrawingFrame] = []
+        control_points: List[npt.NDArray[np.float32]] = []
+        for frame_idx in range(self.retargeter.frame_max_num):
+            joint_depths, root_position = self._pose_rig(frame_idx * frame_time)
+            control_points.append(self.rig.get_joints_2D_positions() - root_position[:2])
+            self._set_draw_indices(joint_depths)
+
+            vertices_xyz = np.empty([self.vertices.shape[0], 3], dtype=np.float32)
+            vertices_xyz[:, 2] = self.rig.root_joint.get_world_position()[2]
+            frames.append({
+                'vertices_xyz': vertices_xyz,
+                'indices': self.indices,
+                'root_position': root_position,
+                'joint_rotations': self.rig.get_joint_rotations(),
+            })
+
+        vertices_xy: npt.NDArray[np.float64] = self.arap.solve_batch(np.stack(control_points))
+        for frame_idx, frame in enumerate(frames):
+            frame['vertices_xyz'][:, :2] = vertices_xy[frame_idx] + frame['root_position'][:2]
+            self.frame_cache[frame_idx] = frame
+
+        # re-pose the character for the current time
+        self.update()
 
-        # temp dictionary to help with seed generation
-        joints_d: Dict[str, CharacterConfig.JointDict] = {}
-        for joint in self.char_cfg.skeleton:
-            joints_d[joint['name']] = joint
-            joints_d[joint['name']]['loc'][1] = 1 - joints_d[joint['name']]['loc'][1]
+    def _pose_rig(self, time: float) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.float32]]:
+        """ Poses the rig using the retargeted motion data at time. Returns the bvh joint depths and root position at that time. """
+        frame_orientations: npt.NDArray[np.float32]
+        joint_depths: npt.NDArray[np.float32]
+        root_position: npt.NDArray[np.float32]
+        frame_orientations, joint_depths, root_position = self.retargeter.get_retargeted_frame_data(time)
+
+        # update the rig's root position and reorient all of its joints
+        self.rig.root_joint.set_position(root_position)
+        self.rig.set_global_orientations(frame_orientations)
+
+        return joint_depths, root_position
+
+    @staticmethod
+    def _compute_disk_cache_key(char_cfg: CharacterConfig, retarget_cfg: RetargetConfig, motion_cfg: MotionConfig) -> str:
+        """ Hash the contents of the character's mask, texture, BVH, and configs. Filepaths themselves are not hashed. """
+        h = hashlib.sha256(f'AnimatedDrawing disk cache v{AnimatedDrawing.DISK_CACHE_VERSION}'.encode())
+        for file_p in [char_cfg.mask_p, char_cfg.txtr_p, motion_cfg.bvh_p]:
+            with open(str(file_p), 'rb') as f:
+                h.update(f.read())
+        for cfg in [char_cfg, retarget_cfg, motion_cfg]:
+            h.update(repr({key: val for key, val in vars(cfg).items() if not isinstance(val, Path)}).encode())
+        return h.hexdigest()
+
+    def _load_disk_cache(self) -> Optional[Dict[str, npt.NDArray[np.float32]]]:
+        """ Returns arrays saved within self.disk_cache_p, if it exists. Otherwise returns None. """
+        assert isinstance(self.disk_cache_p, Path)  # for static analysis
+        if not self.disk_cache_p.exists():
+            logging.info(f'No AnimatedDrawing disk cache found at {self.disk_cache_p.resolve()}')
+            return None
 
+        try:
+            with np.load(str(self.disk_cache_p)) as npz:
+                disk_cache: Dict[str, npt.NDArray[np.float32]] = dict(npz.items())
+        except Exception as e:
+            logging.warning(f'Error loading AnimatedDrawing disk cache {self.disk_cache_p.resolve()}, ignoring it: {str(e)}')
+            return None
+
+        logging.info(f'Using AnimatedDrawing disk cache located at {self.disk_cache_p.resolve()}')
+        return disk_cache
+
+    def _load_disk_cached_frames(self, disk_cache: Dict[str, npt.NDArray[np.float32]]) -> None:
+        """ Fills the frame cache with the per-frame arrays from the disk cache. """
+        assert isinstance(self.frame_cache, dict)  # for static analysis
+        for frame_idx in range(disk_cache['frame_vertices_xyz'].shape[0]):
+            self.frame_cache[frame_idx] = {
+                'vertices_xyz': disk_cache['frame_vertices_xyz'][frame_idx],
+                'indices': disk_cache['frame_indices'][frame_idx],
+                'root_position': disk_cache['frame_root_positions'][frame_idx],
+                'joint_rotations': disk_cache['frame_joint_rotations'][frame_idx],
+            }
+
+    def _save_disk_cache(self) -> None:
+        """ Saves the mesh, joint->triangle mapping, retargeted motion, and every frame within the frame cache to self.disk_cache_p. """
+        assert isinstance(self.disk_cache_p, Path)  # for static analysis
+        assert isinstance(self.frame_cache, dict)  # for static analysis
+
+        frames: List[AnimatedDrawingFrame] = [self.frame_cache[frame_idx] for frame_idx in range(len(self.frame_cache))]
+        arrays: Dict[str, npt.NDArray[np.float32]] = {
+            'mesh_vertices': self.mesh['vertices'],
+            'mesh_triangles': np.stack(self.mesh['triangles']),
+            'frame_vertices_xyz': np.stack([frame['vertices_xyz'] for frame in frames]),
+            'frame_indices': np.stack([frame['indices'] for frame in frames]),
+            'frame_root_positions': np.stack([frame['root_position'] for frame in frames]),
+            'frame_joint_rotations': np.stack([frame['joint_rotations'] for frame in frames]),
+            'frame_time': np.array(self.retargeter.frame_time),
+            'char_joint_orientations': self.retargeter.char_joint_orientations,
+            'bvh_joint_depths': self.retargeter.bvh_joint_depths,
+            'char_root_positions': self.retargeter.char_root_positions,
+            'depth_driver_idxs': self._depth_driver_idxs,
+            'depth_driver_weights': self._depth_driver_weights,
+        }
+        for joint_name, tri_v_idx in self.joint_to_tri_v_idx.items():
+            arrays[f'joint_to_tri_v_idx/{joint_name}'] = tri_v_idx
+
+        # write to a temporary file first, so concurrent renders never read a partially written cache
+        self.disk_cache_p.parent.mkdir(exist_ok=True, parents=True)
+        tmp_p = self.disk_cache_p.with_suffix(f'.{os.getpid()}.tmp.npz')
+        np.savez(str(tmp_p), **arrays)
+        os.replace(str(tmp_p), str(self.disk_cache_p))
+        logging.info(f'Wrote AnimatedDrawing disk cache to {self.disk_cache_p.resolve()}')
+
+    def _apply_cached_frame(self, frame: AnimatedDrawingFrame) -> None:
+        """ Pose the rig and mesh using results previously computed by update(). """
+        self.rig.root_joint.set_position(frame['root_position'])
+        self.rig.set_joint_rotations(frame['joint_rotations'])
+
+        self.vertices[:, :3] = frame['vertices_xyz']
+        self._vertex_buffer_dirty_bit = True
+
+        self._render_order = None  # render order of cached frame is unknown, so next _set_draw_indices must not skip
+        self._set_indices(frame['indices'])
+
+    def _set_indices(self, indices: npt.NDArray[np.int32]) -> None:
+        """ Sets the render order of mesh vertices, flagging the element buffer for upload only if the order changed. """
+        if indices is not self.indices and not np.array_equal(indices, self.indices):
+            self._index_buffer_dirty_bit = True
+        self.indices = indices
+
+    def _set_draw_indices(self, joint_depths: npt.NDArray[np.float32]):
+
+        # sort segmentation groups by decreasing depth_driver's distance to camera
+        bodypart_depths: npt.NDArray[np.float64] = self._depth_driver_weights @ joint_depths[self._depth_driver_idxs]
+        render_order: Tuple[Tuple[int, bool], ...] = tuple(
+            (int(idx), bool(bodypart_depths[idx] > 0)) for idx in np.argsort(bodypart_depths, kind='stable'))
+
+        # most frames keep the same layering as the previous one; if so, nothing needs to be rebuilt or uploaded
+        if render_order == self._render_order:
+            return
+        self._render_order = render_order
+
+        if render_order not in self._render_order_to_indices:
+            # Add vertices belonging to joints in each segment group in the order they will be rendered
+            indices: List[npt.NDArray[np.int32]] = []
+            for idx, in_front in render_order:
+                intra_bodypart_render_order = 1 if in_front else -1  # if depth driver is behind plane, render bodyparts in reverse order
+                for joint_name in self.retarget_cfg.char_bodypart_groups[idx]['char_joints'][::intra_bodypart_render_order]:
+                    indices.append(self.joint_to_tri_v_idx.get(joint_name, np.array([], dtype=np.int32)))
+            self._render_order_to_indices[render_order] = np.hstack(indices)
+
+        self._set_indices(self._render_order_to_indices[render_order])
+
+    def _initialize_joint_to_triangles_dict(self) -> None:
+        """
+        Finds the closest joint bone (line segment between joint and parent) to each triangle centroid.
+        Distances are computed with BFS or a Euclidean distance transform, depending on char_cfg.joint_segmentation_method.
+        """
         # store joint names and later reference by element location
         joint_name_to_idx: List[str] = [joint['name'] for joint in self.char_cfg.skeleton]
 
-        # seed generation
-        heap: List[Tuple[float, Tuple[int, Tuple[int, int]]]] = []  # [(dist, (joint_idx, (x, y))]
-        for _, joint in joints_d.items():
+        # joint locations with y flipped to match the orientation of the mask
+        joint_locs: Dict[str, List[float]] = {joint['name']: [joint['loc'][0], 1 - joint['loc'][1]] for joint in self.char_cfg.skeleton}
+
+        if self.char_cfg.joint_segmentation_method == 'distance_transform':
+            closest_joint_idx, shortest_distance = self._segment_mask_distance_transform(joint_name_to_idx, joint_locs)
+        else:
+            closest_joint_idx, shortest_distance = self._segment_mask_bfs(joint_name_to_idx, joint_locs)
+
+        # look up the closest joint and distance at every triangle centroid
+        triangles: npt.NDArray[np.int32] = np.stack(self.mesh['triangles'])
+        tri_centroids = (self.mesh['vertices'][triangles].mean(axis=1) * self.img_dim).round().astype(np.int32)
+        tri_closest_joint_idx = closest_joint_idx[tri_centroids[:, 0], tri_centroids[:, 1]]
+        tri_dist_to_bone = shortest_distance[tri_centroids[:, 0], tri_centroids[:, 1]]
+
+        # centroids not reached by the search (idx -1) fall back to the last joint
+        tri_closest_joint_idx = np.where(tri_closest_joint_idx == -1, len(joint_name_to_idx) - 1, tri_closest_joint_idx)
+
+        # keys are added in order of first appearance, matching the original per-triangle loop
+        _, first_appearance = np.unique(tri_closest_joint_idx, return_index=True)
+
+        joint_to_tri_v_idx: Dict[str, npt.NDArray[np.int32]] = {}
+        for joint_idx in tri_closest_joint_idx[np.sort(first_appearance)]:
+            tri_idxs = np.nonzero(tri_closest_joint_idx == joint_idx)[0]
+
+            # sort by distance, descending. stable, so ties keep triangle order
+            tri_idxs = tri_idxs[np.argsort(-tri_dist_to_bone[tri_idxs], kind='stable')]
+
+            joint_to_tri_v_idx[joint_name_to_idx[joint_idx]] = triangles[tri_idxs].flatten()
+
+        self.joint_to_tri_v_idx = joint_to_tri_v_idx
+
+    def _get_bone_seeds(self, joint_name_to_idx: List[str], joint_locs: Dict[str, List[float]], num: int
+                        ) -> List[Tuple[int, npt.NDArray[np.int32]]]:
+        """ Returns (joint_idx, seeds_xy) for each non-root joint, with num seeds evenly spaced along the bone to its parent. """
+        seeds: List[Tuple[int, npt.NDArray[np.int32]]] = []
+        for joint in self.char_cfg.skeleton:
             if joint['parent'] is None:  # skip root joint
                 continue
             joint_idx = joint_name_to_idx.index(joint['name'])
-            dist_joint_xy: List[float] = joint['loc']
-            prox_joint_xy: List[float] = joints_d[joint['parent']]['loc']
-            seeds_xy = (self.img_dim * np.linspace(dist_joint_xy, prox_joint_xy, num=20, endpoint=False)).round()
-            heap.extend([(0, (joint_idx, tuple(seed_xy.astype(np.int32)))) for seed_xy in seeds_xy])
+            dist_joint_xy: List[float] = joint_locs[joint['name']]
+            prox_joint_xy: List[float] = joint_locs[joint['parent']]
+            seeds_xy = (self.img_dim * np.linspace(dist_joint_xy, prox_joint_xy, num=num, endpoint=False)).round()
+            seeds.append((joint_idx, seeds_xy.astype(np.int32)))
+        return seeds
+
+    def _segment_mask_bfs(self, joint_name_to_idx: List[str], joint_locs: Dict[str, List[float]]
+                          ) -> Tuple[npt.NDArray[np.int8], npt.NDArray[np.int32]]:
+        """
+        Uses BFS within the mask to find the closest joint bone to each mask pixel.
+        Returns closest joint idx and distance to it for each pixel.
+        """
+        shortest_distance = np.full(self.mask.shape, 1 << 12, dtype=np.int32)  # to nearest joint
+        closest_joint_idx = np.full(self.mask.shape, -1, dtype=np.int8)  # track joint idx nearest each point
+
+        # seed generation
+        heap: List[Tuple[float, Tuple[int, Tuple[int, int]]]] = []  # [(dist, (joint_idx, (x, y))]
+        for joint_idx, seeds_xy in self._get_bone_seeds(joint_name_to_idx, joint_locs, num=20):
+            heap.extend([(0, (joint_idx, tuple(seed_xy))) for seed_xy in seeds_xy])
 
         # BFS search
         start_time: float = time.time()
@@ -459,27 +747,35 @@ class AnimatedDrawing(Transform, TimeManager):
                 heapq.heappush(heap, (n_distance, (joint_idx, (n_x, n_y))))
         logging.info(f'Finished joint -> mask pixel BFS in {time.time() - start_time} seconds')
 
-        # create map between joint name and triangle centroids it is closest to
-        joint_to_tri_v_idx_and_dist: DefaultDict[str, List[Tuple[npt.NDArray[np.int32], np.int32]]] = defaultdict(list)
-        for tri_v_idx in self.mesh['triangles']:
-            tri_verts = np.array([self.mesh['vertices'][v_idx] for v_idx in tri_v_idx])
-            centroid_x, centroid_y = list((tri_verts.mean(axis=0) * self.img_dim).round().astype(np.int32))
-            tri_centroid_closest_joint_idx: np.int8 = closest_joint_idx[centroid_x, centroid_y]
-            dist_from_tri_centroid_to_bone: np.int32 = shortest_distance[centroid_x, centroid_y]
-            joint_to_tri_v_idx_and_dist[joint_name_to_idx[tri_centroid_closest_joint_idx]].append((tri_v_idx, dist_from_tri_centroid_to_bone))
+        return closest_joint_idx, shortest_distance
 
-        joint_to_tri_v_idx: Dict[str, npt.NDArray[np.int32]] = {}
-        for key, val in joint_to_tri_v_idx_and_dist.items():
-            # sort by distance, descending
-            val.sort(key=lambda x: float(x[1]), reverse=True)
+    def _segment_mask_distance_transform(self, joint_name_to_idx: List[str], joint_locs: Dict[str, List[float]]
+                                         ) -> Tuple[npt.NDArray[np.int8], npt.NDArray[np.int32]]:
+        """
+        Uses a Euclidean distance transform from the rasterized bones to find the closest joint bone to each mask pixel.
+        Distances are straight-line, not constrained to the mask. Same outputs as _segment_mask_bfs.
+        """
+        start_time: float = time.time()
+        logging.info('Starting joint -> mask pixel distance transform')
 
-            # retain vertex indices, remove distance info
-            val = [v[0] for v in val]
+        # rasterize bones, with roughly one seed per pixel of bone length
+        bone_labels = np.full(self.mask.shape, -1, dtype=np.int8)
+        for joint_idx, seeds_xy in self._get_bone_seeds(joint_name_to_idx, joint_locs, num=self.img_dim):
+            seeds_xy = np.clip(seeds_xy, 0, self.img_dim - 1)
+            bone_labels[seeds_xy[:, 0], seeds_xy[:, 1]] = joint_idx
 
-            # convert to np array and save in dictionary
-            joint_to_tri_v_idx[key] = np.array(val).flatten()  # type: ignore
+        # for each pixel, distance to and location of nearest bone pixel
+        distance, (nearest_x, nearest_y) = ndimage.distance_transform_edt(bone_labels == -1, return_indices=True)
 
-        self.joint_to_tri_v_idx = joint_to_tri_v_idx
+        outside_mask = self.mask == 0
+        closest_joint_idx = bone_labels[nearest_x, nearest_y]
+        closest_joint_idx[outside_mask] = -1
+        shortest_distance = distance.astype(np.int32)
+        shortest_distance[outside_mask] = 1 << 12
+
+        logging.info(f'Finished joint -> mask pixel distance transform in {time.time() - start_time} seconds')
+
+        return closest_joint_idx, shortest_distance
 
     def _load_mask(self) -> npt.NDArray[np.uint8]:
         """ Load and perform preprocessing upon the mask """
@@ -545,17 +841,15 @@ class AnimatedDrawing(Transform, TimeManager):
             contours.sort(key=len, reverse=True)
 
         outside_vertices: npt.NDArray[np.float64] = measure.approximate_polygon(contours[0], tolerance=0.25)
-        character_outline = geometry.Polygon(contours[0])
+        character_outline: npt.NDArray[np.float64] = contours[0]
 
-        # add some internal vertices to ensure a good mesh is created
-        inside_vertices_xy: List[Tuple[np.float32, np.float32]] = []
-        _x = np.linspace(0, self.img_dim, 40)
-        _y = np.linspace(0, self.img_dim, 40)
+        # add some internal vertices, from a grid spanning the image, to ensure a good mesh is created
+        grid_size: int = self.char_cfg.mesh_interior_grid_size
+        _x = np.linspace(0, self.img_dim, grid_size)
+        _y = np.linspace(0, self.img_dim, grid_size)
         xv, yv = np.meshgrid(_x, _y)
-        for x, y in zip(xv.flatten(), yv.flatten()):
-            if character_outline.contains(geometry.Point(x, y)):
-                inside_vertices_xy.append((x, y))
-        inside_vertices: npt.NDArray[np.float64] = np.array(inside_vertices_xy)
+        grid_xy: npt.NDArray[np.float64] = np.stack([xv.flatten(), yv.flatten()], axis=1)
+        inside_vertices: npt.NDArray[np.float64] = grid_xy[measure.points_in_poly(grid_xy, character_outline)]
 
         vertices: npt.NDArray[np.float32] = np.concatenate([outside_vertices, inside_vertices]).astype(np.float32)
 
@@ -565,13 +859,9 @@ class AnimatedDrawing(Transform, TimeManager):
         falls outside the character's outline.
         """
         convex_hull_triangles = Delaunay(vertices)
-        triangles: List[npt.NDArray[np.int32]] = []
-        for _triangle in convex_hull_triangles.simplices:
-            tri_vertices = np.array(
-                [vertices[_triangle[0]], vertices[_triangle[1]], vertices[_triangle[2]]])
-            tri_centroid = geometry.Point(np.mean(tri_vertices, 0))
-            if character_outline.contains(tri_centroid):
-                triangles.append(_triangle)
+        tri_centroids: npt.NDArray[np.float32] = np.mean(vertices[convex_hull_triangles.simplices], axis=1)
+        is_inside_outline: npt.NDArray[np.bool8] = measure.points_in_poly(tri_centroids, character_outline)
+        triangles: List[npt.NDArray[np.int32]] = list(convex_hull_triangles.simplices[is_inside_outline])
 
         vertices /= self.img_dim  # scale vertices so they lie between 0-1
 
@@ -584,8 +874,7 @@ class AnimatedDrawing(Transform, TimeManager):
         """
         self.vertices = np.zeros((self.mesh['vertices'].shape[0], 8), np.float32)
 
-        # initialize xy positions of mesh vertices
-        self.vertices[:, :2] = self.arap.solve(self.rig.get_joints_2D_positions()).reshape([-1, 2])
+        # xy positions of mesh vertices are set by update()
 
         # initialize texture coordinates
         self.vertices[:, 6] = self.mesh['vertices'][:, 1]                        # u tex
@@ -628,7 +917,8 @@ class AnimatedDrawing(Transform, TimeManager):
         # buffer element index data
         GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.ebo)
         GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER,
-                        self.indices, GL.GL_STATIC_DRAW)
+                        self.indices, GL.GL_DYNAMIC_DRAW)
+        self._index_buffer_nbytes = self.indices.nbytes
 
         # position attributes
         GL.glVertexAttribPointer(
@@ -648,21 +938,30 @@ class AnimatedDrawing(Transform, TimeManager):
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
         GL.glBindVertexArray(0)
 
+        self._vertex_buffer_dirty_bit = False
+        self._index_buffer_dirty_bit = False
         self._is_opengl_initialized = True
 
     def _rebuffer_vertex_data(self):
-        GL.glBindVertexArray(self.vao)
+        # buffers were allocated in _initialize_opengl_resources; vertex count never changes, so overwrite in place
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
-        GL.glBufferData(GL.GL_ARRAY_BUFFER, self.vertices, GL.GL_STATIC_DRAW)
+        GL.glBufferSubData(GL.GL_ARRAY_BUFFER, 0, self.vertices.nbytes, self.vertices)
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
 
-        # buffer element index data
-        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.ebo)
-        GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER,
-                        self.indices, GL.GL_STATIC_DRAW)
+        self._vertex_buffer_dirty_bit = False
 
+    def _rebuffer_index_data(self):
+        # element buffer binding is part of the vao's state
+        GL.glBindVertexArray(self.vao)
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        if self.indices.nbytes == self._index_buffer_nbytes:
+            GL.glBufferSubData(GL.GL_ELEMENT_ARRAY_BUFFER, 0, self.indices.nbytes, self.indices)
+        else:  # number of rendered triangles changed, so reallocate
+            GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, self.indices, GL.GL_DYNAMIC_DRAW)
+            self._index_buffer_nbytes = self.indices.nbytes
         GL.glBindVertexArray(0)
-        self._vertex_buffer_dirty_bit = False
+
+        self._index_buffer_dirty_bit = False
 
     def _draw(self, **kwargs):
 
@@ -672,6 +971,9 @@ class AnimatedDrawing(Transform, TimeManager):
         if self._vertex_buffer_dirty_bit:
             self._rebuffer_vertex_data()
 
+        if self._index_buffer_dirty_bit:
+            self._rebuffer_index_data()
+
         GL.glBindVertexArray(self.vao)
 
         if kwargs['viewer_cfg'].draw_ad_txtr:
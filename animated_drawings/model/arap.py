@@ -4,9 +4,8 @@
 
 import numpy as np
 import numpy.typing as npt
-from collections import defaultdict
 import logging
-from typing import List, Dict, Set, Tuple
+from typing import List, Tuple
 import scipy.sparse.linalg as spla
 import scipy.sparse as sp
 
@@ -38,7 +37,7 @@ class ARAP():
     between (e' in E') and (e in E). This way, rotation is essentially free, while scaling is not.
     """
 
-    def __init__(self, pins_xy: npt.NDArray[np.float32], triangles: List[npt.NDArray[np.int32]], vertices: npt.NDArray[np.float32], w: int = 1000):  # noqa: C901
+    def __init__(self, pins_xy: npt.NDArray[np.float32], triangles: List[npt.NDArray[np.int32]], vertices: npt.NDArray[np.float32], w: int = 1000):
         """
         Sets up the matrices needed for later solves.
 
@@ -51,121 +50,131 @@ class ARAP():
 
         self.vertices = np.copy(vertices)
 
-        # build a deduplicated list of edge->vertex IDS...
-        self.e_v_idxs: List[Tuple[np.int32, np.int32]] = []
-        for v0, v1, v2 in triangles:
-            self.e_v_idxs.append(tuple(sorted((v0, v1))))
-            self.e_v_idxs.append(tuple(sorted((v1, v2))))
-            self.e_v_idxs.append(tuple(sorted((v2, v0))))
-        self.e_v_idxs = list(set(self.e_v_idxs))  # ...and deduplicate it
-
-        # build list of edge vectors
-        _edge_vectors: List[npt.NDArray[np.float32]] = []
-        for vi_idx, vj_idx in self.e_v_idxs:
-            vi = self.vertices[vi_idx]
-            vj = self.vertices[vj_idx]
-            _edge_vectors.append(vj - vi)
-        self.edge_vectors: npt.NDArray[np.float32] = np.array(_edge_vectors)
+        # build a deduplicated array of edge->vertex IDS, [E, 2]
+        tri_v_idxs: npt.NDArray[np.int32] = np.asarray(triangles, dtype=np.int32).reshape([-1, 3])
+        _e_v_idxs = np.concatenate([tri_v_idxs[:, [0, 1]], tri_v_idxs[:, [1, 2]], tri_v_idxs[:, [2, 0]]])
+        self.e_v_idxs: npt.NDArray[np.int32] = np.unique(np.sort(_e_v_idxs, axis=1), axis=0)
+
+        # build array of edge vectors
+        self.edge_vectors: npt.NDArray[np.float32] = self.vertices[self.e_v_idxs[:, 1]] - self.vertices[self.e_v_idxs[:, 0]]
 
         # get barycentric coordinates of pins, and mask denoting which pins were initially outside the mesh
         pins_bc: List[Tuple[Tuple[np.int32, np.float32], Tuple[np.int32, np.float32], Tuple[np.int32, np.float32]]]
         self.pin_mask = npt.NDArray[np.bool8]
         pins_bc, self.pin_mask = self._xy_to_barycentric_coords(pins_xy, vertices, triangles)
 
-        v_vnbr_idxs: Dict[np.int32, Set[np.int32]] = defaultdict(set)  # build a dict mapping vertex ID -> neighbor vertex IDs
-        for v0, v1, v2 in triangles:
-            v_vnbr_idxs[v0] |= {v1, v2}
-            v_vnbr_idxs[v1] |= {v2, v0}
-            v_vnbr_idxs[v2] |= {v0, v1}
-
         self.edge_num = len(self.e_v_idxs)
         self.vert_num = len(self.vertices)
         self.pin_num = len(pins_xy[self.pin_mask])
 
-        self.A1: npt.NDArray[np.float32] = np.zeros([2 * (self.edge_num + self.pin_num), 2 * self.vert_num], dtype=np.float32)
-        G: npt.NDArray[np.float32] = np.zeros([2 * self.edge_num, 2 * self.vert_num], dtype=np.float32)  # holds edge rotation calculations
+        # split the pins' barycentric coords into [P, 3] arrays of vertex IDs and weights
+        pin_v_idxs: npt.NDArray[np.int32] = np.array([[v_idx for v_idx, _ in pin_bc] for pin_bc in pins_bc], dtype=np.int32).reshape([-1, 3])
+        pin_v_ws: npt.NDArray[np.float32] = np.array([[v_w for _, v_w in pin_bc] for pin_bc in pins_bc], dtype=np.float32).reshape([-1, 3])
 
-        # populate top half of A1, one row per edge
-        for k, (vi_idx, vj_idx) in enumerate(self.e_v_idxs):
+        # sparse vertex adjacency matrix. An edge's 'neighbor' vertices are those adjacent to both of its vertices
+        adj: csr_matrix = sp.csr_matrix((np.ones(2 * self.edge_num, dtype=np.int32),
+                                         (self.e_v_idxs.T.flatten(), self.e_v_idxs[:, ::-1].T.flatten())),
+                                        shape=[self.vert_num, self.vert_num])
+        e_vnbrs: csr_matrix = adj[self.e_v_idxs[:, 0]].multiply(adj[self.e_v_idxs[:, 1]]).tocsr()
+        e_vnbrs.eliminate_zeros()
+        e_vnbr_counts: npt.NDArray[np.int32] = np.diff(e_vnbrs.indptr)
 
-            # initialize self.A1 with 1, -1 denoting beginning and end of x and y dims of vector
-            self.A1[2*k:2*(k+1), 2*vi_idx:2*(vi_idx+1)] = -np.identity(2)
-            self.A1[2*k:2*(k+1), 2*vj_idx:2*(vj_idx+1)] = np.identity(2)
+        # sparse triplets of A1 and G (which holds edge rotation calculations)
+        A1_rows: List[npt.NDArray[np.int64]] = []
+        A1_cols: List[npt.NDArray[np.int64]] = []
+        A1_vals: List[npt.NDArray[np.float32]] = []
+        G_vals: List[npt.NDArray[np.float32]] = []
 
-            # Find the 'neighbor' vertices for this edge: {v_i, v_j,v_r, v_l}
-            vi_vnbr_idxs: Set[np.int32] = v_vnbr_idxs[vi_idx]
-            vj_vnbr_idxs: Set[np.int32] = v_vnbr_idxs[vj_idx]
-            e_vnbr_idxs: List[np.int32] = list(vi_vnbr_idxs.intersection(vj_vnbr_idxs))
-            e_vnbr_idxs.insert(0, vi_idx)
-            e_vnbr_idxs.insert(1, vj_idx)
+        # populate top half of A1, two rows per edge. Edges are batched by their number of neighbor vertices
+        for nbr_num in np.unique(e_vnbr_counts):
+            k: npt.NDArray[np.int64] = np.flatnonzero(e_vnbr_counts == nbr_num)  # ids of edges within batch
 
-            e_vnbr_xys: Tuple[np.float32, np.float32] = tuple([self.vertices[v_idx] for v_idx in e_vnbr_idxs])
+            # Find the 'neighbor' vertices for each edge: {v_i, v_j, v_r, v_l}
+            nbr_v_idxs = e_vnbrs.indices[np.expand_dims(e_vnbrs.indptr[k], axis=1) + np.arange(nbr_num)]
+            e_vnbr_idxs: npt.NDArray[np.int32] = np.hstack([self.e_v_idxs[k], nbr_v_idxs])
 
-            _: List[Tuple[float, float]] = []
-            for v in e_vnbr_xys[1:]:
-                vx: float = v[0] - e_vnbr_xys[0][0]
-                vy: float = v[1] - e_vnbr_xys[0][1]
-                _.extend(((vx, vy), (vy, -vx)))
-            G_k: npt.NDArray[np.float32] = np.array(_)
+            # each neighbor (and v_j) contributes rows (vx, vy) and (vy, -vx) to G_k, with v relative to v_i
+            v = self.vertices[e_vnbr_idxs[:, 1:]] - self.vertices[e_vnbr_idxs[:, :1]]
+            G_k = np.stack([v, np.stack([v[..., 1], -v[..., 0]], axis=-1)], axis=2).reshape([len(k), -1, 2])
 
-            G_k_star: npt.NDArray[np.float32] = np.linalg.inv(G_k.T @ G_k) @ G_k.T
+            G_k_T = np.transpose(G_k, (0, 2, 1))
+            G_k_star = np.linalg.inv(G_k_T @ G_k) @ G_k_T
 
-            e_kx, e_ky = self.edge_vectors[k]
+            e_kx, e_ky = self.edge_vectors[k, 0], self.edge_vectors[k, 1]
             e = np.array([
                 [e_kx,  e_ky],
                 [e_ky, -e_kx]
-            ], np.float32)
-
-            edge_matrix = np.hstack([np.tile(-np.identity(2), (len(e_vnbr_idxs)-1, 1)), np.identity(2*(len(e_vnbr_idxs)-1))])
-            g = np.dot(G_k_star, edge_matrix)
-            h = np.dot(e, g)
-
-            for h_offset, v_idx in enumerate(e_vnbr_idxs):
-                self.A1[2*k:2*(k+1), 2*v_idx:2*(v_idx+1)] -= h[:, 2*h_offset:2*(h_offset+1)]
-                G[2*k:2*(k+1), 2*v_idx:2*(v_idx+1)] = g[:, 2*h_offset:2*(h_offset+1)]
-
-        # populate bottom row of A1, one row per constraint-dimension
-        for pin_idx, pin_bc in enumerate(pins_bc):
-            for v_idx, v_w in pin_bc:
-                self.A1[2*self.edge_num + 2*pin_idx  , 2*v_idx]     = self.w * v_w  # x component
-                self.A1[2*self.edge_num + 2*pin_idx+1, 2*v_idx + 1] = self.w * v_w  # y component
-
-        A2_top: npt.NDArray[np.float32] = np.zeros([self.edge_num, self.vert_num], dtype=np.float32)
-        for k, (vi_idx, vj_idx) in enumerate(self.e_v_idxs):
-            A2_top[k, vi_idx] = -1
-            A2_top[k, vj_idx] = 1
-
-        A2_bot: npt.NDArray[np.float32] = np.zeros([self.pin_num, self.vert_num], dtype=np.float32)
-        for pin_idx, pin_bc in enumerate(pins_bc):
-            for v_idx, v_w in pin_bc:
-                A2_bot[pin_idx, v_idx] = self.w * v_w
-
-        self.A2: npt.NDArray[np.float32] = np.vstack([A2_top, A2_bot])
-
-        # for speed, convert to sparse matrices and cache for later
-        self.tA1: csr_matrix = sp.csr_matrix(self.A1.transpose())
-        self.tA2: csr_matrix = sp.csr_matrix(self.A2.transpose())
-        self.G: csr_matrix = sp.csr_matrix(G)
-
-        # perturbing singular matrix and calling det can trigger overflow warning- ignore it
-        old_settings = np.seterr(over='ignore')
-
-        # ensure tA1xA1 matrix isn't singular and cache sparse repsentation
-        tA1xA1_dense: npt.NDArray[np.float32] = self.tA1 @ self.A1
-        while np.linalg.det(tA1xA1_dense) == 0.0:
-            logging.info('tA1xA1 is singular. perturbing...')
-            tA1xA1_dense += 0.00000001 * np.identity(tA1xA1_dense.shape[0])
-        self.tA1xA1: csr_matrix = sp.csr_matrix(tA1xA1_dense)
-
-        # ensure tA2xA2 matrix isn't singular and cache sparse repsentation
-        tA2xA2_dense: npt.NDArray[np.float32] = self.tA2 @ self.A2
-        while np.linalg.det(tA2xA2_dense) == 0.0:
-            logging.info('tA2xA2 is singular. perturbing...')
-            tA2xA2_dense += 0.00000001 * np.identity(tA2xA2_dense.shape[0])
-        self.tA2xA2: csr_matrix = sp.csr_matrix(tA2xA2_dense)
-
-        # revert np overflow warnings behavior
-        np.seterr(**old_settings)
+            ], np.float32).transpose((2, 0, 1))
+
+            edge_matrix = np.hstack([np.tile(-np.identity(2), (nbr_num + 1, 1)), np.identity(2 * (nbr_num + 1))])
+            g = G_k_star @ edge_matrix
+            h = e @ g
+
+            # initialize with 1, -1 denoting beginning and end of x and y dims of vector, then subtract h
+            A1_k = -h
+            A1_k[:, :, 0:2] -= np.identity(2)
+            A1_k[:, :, 2:4] += np.identity(2)
+
+            # each 2x2 block of A1_k and g goes at rows of edge k and columns of its neighbor vertex
+            rows = np.broadcast_to(2 * k.reshape([-1, 1, 1, 1]) + np.arange(2).reshape([1, 2, 1, 1]), A1_k.reshape([len(k), 2, -1, 2]).shape)
+            cols = np.broadcast_to(2 * np.expand_dims(e_vnbr_idxs, axis=(1, 3)) + np.arange(2).reshape([1, 1, 1, 2]), rows.shape)
+            A1_rows.append(rows.flatten())
+            A1_cols.append(cols.flatten())
+            A1_vals.append(A1_k.flatten().astype(np.float32))
+            G_vals.append(g.flatten().astype(np.float32))
+
+        G_rows = np.concatenate(A1_rows)
+        G_cols = np.concatenate(A1_cols)
+
+        # populate bottom rows of A1, one row per constraint-dimension
+        pin_rows = 2 * self.edge_num + 2 * np.repeat(np.arange(self.pin_num), 3)
+        A1_rows.extend([pin_rows, pin_rows + 1])                                     # x and y components
+        A1_cols.extend([2 * pin_v_idxs.flatten(), 2 * pin_v_idxs.flatten() + 1])
+        A1_vals.extend([self.w * pin_v_ws.flatten(), self.w * pin_v_ws.flatten()])
+
+        self.A1: csr_matrix = sp.csr_matrix((np.concatenate(A1_vals), (np.concatenate(A1_rows), np.concatenate(A1_cols))),
+                                            shape=[2 * (self.edge_num + self.pin_num), 2 * self.vert_num], dtype=np.float32)
+        G: csr_matrix = sp.csr_matrix((np.concatenate(G_vals), (G_rows, G_cols)),
+                                      shape=[2 * self.edge_num, 2 * self.vert_num], dtype=np.float32)
+
+        # A2 has one row per edge followed by one row per pin
+        e_rows = np.arange(self.edge_num)
+        A2_rows = np.concatenate([e_rows, e_rows, self.edge_num + np.repeat(np.arange(self.pin_num), 3)])
+        A2_cols = np.concatenate([self.e_v_idxs[:, 0], self.e_v_idxs[:, 1], pin_v_idxs.flatten()])
+        A2_vals = np.concatenate([np.full(self.edge_num, -1.0), np.full(self.edge_num, 1.0), self.w * pin_v_ws.flatten()])
+        self.A2: csr_matrix = sp.csr_matrix((A2_vals, (A2_rows, A2_cols)), shape=[self.edge_num + self.pin_num, self.vert_num], dtype=np.float32)
+
+        # cache transposes for later
+        self.tA1: csr_matrix = self.A1.T.tocsr()
+        self.tA2: csr_matrix = self.A2.T.tocsr()
+        self.G: csr_matrix = G
+
+        # tA1xA1 and tA2xA2 never change, so factorize them once here. Each solve is then just back-substitution
+        self.tA1xA1: csr_matrix
+        self.tA1xA1_lu: spla.SuperLU
+        self.tA1xA1, self.tA1xA1_lu = self._factorize((self.tA1.astype(np.float64) @ self.A1).tocsr(), 'tA1xA1')
+
+        self.tA2xA2: csr_matrix
+        self.tA2xA2_lu: spla.SuperLU
+        self.tA2xA2, self.tA2xA2_lu = self._factorize((self.tA2.astype(np.float64) @ self.A2).tocsr(), 'tA2xA2')
+
+        # right hand sides of the two solves. Preallocated and refilled in place by each solve
+        self.b1: npt.NDArray[np.float64] = np.zeros([2 * (self.edge_num + self.pin_num)], dtype=np.float64)
+        self.b2: npt.NDArray[np.float64] = np.zeros([self.edge_num + self.pin_num, 2], dtype=np.float64)
+
+    @staticmethod
+    def _factorize(m: csr_matrix, name: str) -> Tuple[csr_matrix, spla.SuperLU]:
+        """
+        LU factorizes the sparse square matrix m. If the factorization shows m is singular, perturb its diagonal and try again.
+        Returns the (possibly perturbed) matrix and its factorization.
+        """
+        m = m.astype(np.float64)
+        while True:
+            try:
+                return m, spla.splu(m.tocsc())
+            except RuntimeError:  # raised by splu when m is exactly singular
+                logging.info(f'{name} is singular. perturbing...')
+                m = (m + 0.00000001 * sp.identity(m.shape[0], dtype=np.float64, format='csr')).tocsr()
 
     def solve(self, pins_xy_: npt.NDArray[np.float32]) -> npt.NDArray[np.float64]:
         """
@@ -181,28 +190,61 @@ class ARAP():
 
         assert len(pins_xy) == self.pin_num
 
-        self.b1: npt.NDArray[np.float64] = np.hstack([np.zeros([2 * self.edge_num], dtype=np.float64), self.w * pins_xy.reshape([-1, ])])
-        v1: npt.NDArray[np.float64] = spla.spsolve(self.tA1xA1, self.tA1 @ self.b1.T)
-
-        T1: npt.NDArray[np.float64] = self.G @ v1
-        b2_top = np.empty([self.edge_num, 2], dtype=np.float64)
-        for idx, e0 in enumerate(self.edge_vectors):
-            c: np.float64 = T1[2*idx]
-            s: np.float64 = T1[2*idx + 1]
-            scale = 1.0 / np.sqrt(c * c + s * s)
-            c *= scale
-            s *= scale
-            T2 = np.asarray(((c, s), (-s, c)))  # create rotation matrix
-            e1 = np.dot(T2, e0)                 # and rotate old vector to get new
-            b2_top[idx] = e1
-        b2 = np.vstack([b2_top, self.w * pins_xy])
-        b2x = b2[:, 0]
-        b2y = b2[:, 1]
-
-        v2x: npt.NDArray[np.float64] = spla.spsolve(self.tA2xA2, self.tA2 @ b2x)
-        v2y: npt.NDArray[np.float64] = spla.spsolve(self.tA2xA2, self.tA2 @ b2y)
-
-        return np.vstack((v2x, v2y)).T
+        self.b1[2 * self.edge_num:] = self.w * pins_xy.reshape([-1, ])
+        v1: npt.NDArray[np.float64] = self.tA1xA1_lu.solve(self.tA1 @ self.b1)
+
+        # normalize each edge's (c, s) to get its rotation...
+        T1: npt.NDArray[np.float64] = (self.G @ v1).reshape([-1, 2])
+        T1 /= np.linalg.norm(T1, axis=1, keepdims=True)
+        c, s = T1[:, 0], T1[:, 1]
+
+        # ... and rotate old edge vectors by ((c, s), (-s, c)) to get new
+        e0x, e0y = self.edge_vectors[:, 0], self.edge_vectors[:, 1]
+        self.b2[:self.edge_num, 0] = c * e0x + s * e0y
+        self.b2[:self.edge_num, 1] = c * e0y - s * e0x
+        self.b2[self.edge_num:] = self.w * pins_xy
+
+        # solve for x and y at once, using each as a column of the right hand side
+        v2: npt.NDArray[np.float64] = self.tA2xA2_lu.solve(self.tA2 @ self.b2)
+
+        return v2
+
+    def solve_batch(self, pins_xy_: npt.NDArray[np.float32]) -> npt.NDArray[np.float64]:
+        """
+        Same as solve(), but for many sets of pin positions (e.g. every frame of a motion) at once.
+        Each set of pin positions becomes a column of the right hand side, so all are solved with the cached factorizations together.
+
+        pins_xy: ndarray [F, N, 2] with new pin xy positions for each of F frames
+        return: ndarray [F, N, 2], the updated xy locations of each vertex in the mesh, for each frame
+        """
+
+        # remove any pins that were orgininally outside the mesh
+        pins_xy: npt.NDArray[np.float32] = pins_xy_[:, self.pin_mask]  # pyright: ignore[reportGeneralTypeIssues]
+
+        assert pins_xy.shape[1] == self.pin_num
+
+        frame_num = pins_xy.shape[0]
+
+        b1 = np.zeros([2 * (self.edge_num + self.pin_num), frame_num], dtype=np.float64)
+        b1[2 * self.edge_num:] = self.w * pins_xy.reshape([frame_num, -1]).T
+        v1: npt.NDArray[np.float64] = self.tA1xA1_lu.solve(self.tA1 @ b1)
+
+        # normalize each edge's (c, s) to get its rotation, per frame...
+        T1: npt.NDArray[np.float64] = (self.G @ v1).reshape([self.edge_num, 2, frame_num])
+        T1 /= np.linalg.norm(T1, axis=1, keepdims=True)
+        c, s = T1[:, 0], T1[:, 1]
+
+        # ... and rotate old edge vectors by ((c, s), (-s, c)) to get new
+        e0x, e0y = self.edge_vectors[:, :1], self.edge_vectors[:, 1:]
+        b2 = np.empty([self.edge_num + self.pin_num, frame_num, 2], dtype=np.float64)
+        b2[:self.edge_num, :, 0] = c * e0x + s * e0y
+        b2[:self.edge_num, :, 1] = c * e0y - s * e0x
+        b2[self.edge_num:] = self.w * np.transpose(pins_xy, (1, 0, 2))
+
+        # solve for x and y of every frame at once
+        v2: npt.NDArray[np.float64] = self.tA2xA2_lu.solve(self.tA2 @ b2.reshape([-1, 2 * frame_num]))
+
+        return np.transpose(v2.reshape([self.vert_num, frame_num, 2]), (1, 0, 2))
 
     def _xy_to_barycentric_coords(self,
                                   points: npt.NDArray[np.float32],
@@ -3,9 +3,10 @@
 # LICENSE file in the root directory of this source tree.
 
 from __future__ import annotations  # so we can refer to class Type inside class
+import json
 import logging
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional
 
 import numpy as np
 import numpy.typing as npt
@@ -38,6 +39,71 @@ class BVH_Joint(Joint):
             self.widget.draw(**kwargs)
 
 
+class BVH_Skeleton():
+    """
+    Flattened, array-backed representation of a BVH skeleton. Joints are stored in depth-first order, the order in which BVH rotation data is stored.
+    The BVH_Joint tree it is built from becomes a view over it: each joint's translation and rotation matrices are views into
+    translate_ms and rotate_ms, so whole poses can be applied with array operations.
+    """
+
+    def __init__(self, root_joint: BVH_Joint) -> None:
+        self.root_joint: BVH_Joint = root_joint
+
+        # flatten skeleton in depth-first order
+        self.joints: List[BVH_Joint] = []
+        parent_idxs: List[int] = []
+
+        def _add_joint(joint: BVH_Joint, parent_idx: int) -> None:
+            joint_idx = len(self.joints)
+            self.joints.append(joint)
+            parent_idxs.append(parent_idx)
+            for child in joint.get_children():
+                if isinstance(child, BVH_Joint):
+                    _add_joint(child, joint_idx)
+        _add_joint(root_joint, -1)
+
+        self.joint_num: int = len(self.joints)
+        self.joint_names: List[str] = [str(joint.name) for joint in self.joints]
+        self.parent_idxs: npt.NDArray[np.int32] = np.array(parent_idxs, dtype=np.int32)  # -1 for root
+
+        # if names are repeated (e.g. 'End Site'), map to the first one, as get_transform_by_name() would
+        self.name_to_idx: Dict[str, int] = {}
+        for joint_idx, joint_name in enumerate(self.joint_names):
+            self.name_to_idx.setdefault(joint_name, joint_idx)
+
+        # layout of each joint's channels within a frame of motion data
+        self.channel_orders: List[List[str]] = [list(joint.channel_order) for joint in self.joints]
+        self.channel_counts: npt.NDArray[np.int32] = np.array([len(channel_order) for channel_order in self.channel_orders], dtype=np.int32)
+        self.channel_starts: npt.NDArray[np.int32] = (np.cumsum(self.channel_counts) - self.channel_counts).astype(np.int32)
+
+        # joint transform matrices. Each joint's own matrices become views into these
+        self.translate_ms: npt.NDArray[np.float32] = np.stack([joint._translate_m for joint in self.joints]).astype(np.float32)
+        self.rotate_ms: npt.NDArray[np.float32] = np.stack([joint._rotate_m for joint in self.joints]).astype(np.float32)
+        for joint_idx, joint in enumerate(self.joints):
+            joint._translate_m = self.translate_ms[joint_idx]
+            joint._rotate_m = self.rotate_ms[joint_idx]
+
+    @property
+    def offsets(self) -> npt.NDArray[np.float32]:
+        """ View of each joint's translational offset from its parent, shape [joint_num, 3] """
+        return self.translate_ms[:, :-1, -1]
+
+    def get_channels(self) -> List[str]:
+        """ Returns the channels of all joints in the order they appear within each frame of motion data """
+        return [channel for channel_order in self.channel_orders for channel in channel_order]
+
+    def get_joint_by_name(self, name: str) -> Optional[BVH_Joint]:
+        """ Returns joint with matching name if found, None otherwise. """
+        joint_idx: Optional[int] = self.name_to_idx.get(name)
+        return None if joint_idx is None else self.joints[joint_idx]
+
+    def set_rotations(self, qs: npt.NDArray[np.float32]) -> None:
+        """ Set the rotations of all joints at once from an array of unit quaternions, shape [joint_num, 4] """
+        Quaternions(qs, normalize=False).to_rotation_matrices(out=self.rotate_ms)
+        for joint in self.joints:
+            joint.dirty_bit = True
+
+
 class BVH(Transform, TimeManager):
     """
     Class to encapsulate BVH (Biovision Hierarchy) animation data.
@@ -45,9 +111,16 @@ class BVH(Transform, TimeManager):
     and skeletal pos/rot data for each frame
     """
 
+    # compiled BVH files begin with COMPILED_MAGIC, followed by the little-endian uint64 length of a json header,
+    # the header itself, and the raw arrays at the offsets it specifies. Increment version if the layout changes.
+    COMPILED_MAGIC: bytes = b'ADBVH\x00\x00\x00'
+    COMPILED_VERSION: int = 1
+    COMPILED_SUFFIX: str = '.bvhc'
+    _COMPILED_ALIGNMENT: int = 64  # byte alignment of arrays within compiled file
+
     def __init__(self,
                  name: str,
-                 root_joint: BVH_Joint,
+                 skeleton: BVH_Skeleton,
                  frame_max_num: int,
                  frame_time: float,
                  pos_data: npt.NDArray[np.float32],
@@ -64,16 +137,17 @@ class BVH(Transform, TimeManager):
         self.pos_data: npt.NDArray[np.float32] = pos_data
         self.rot_data: npt.NDArray[np.float32] = rot_data
 
-        self.root_joint = root_joint
+        self.skeleton: BVH_Skeleton = skeleton
+        self.root_joint: BVH_Joint = skeleton.root_joint
         self.add_child(self.root_joint)
-        self.joint_num = self.root_joint.joint_count()
+        self.joint_num: int = skeleton.joint_num
 
         self.cur_frame = 0  # initialize skeleton pose to first frame
         self.apply_frame(self.cur_frame)
 
     def get_joint_names(self) -> List[str]:
         """ Get names of joints in skeleton in the order in which BVH rotation data is stored. """
-        return self.root_joint.get_chain_joint_names()
+        return list(self.skeleton.joint_names)
 
     def update(self) -> None:
         """Based upon internal time, determine which frame should be displayed and apply it"""
@@ -84,18 +158,48 @@ class BVH(Transform, TimeManager):
     def apply_frame(self, frame_num: int) -> None:
         """ Apply root position and joint rotation data for specified frame_num """
         self.root_joint.set_position(self.pos_data[frame_num])
-        self._apply_frame_rotations(self.root_joint, frame_num, ptr=np.array(0))
+        self.skeleton.set_rotations(self.rot_data[frame_num])
+
+    def compute_world_positions(self) -> npt.NDArray[np.float32]:
+        """
+        Batched forward kinematics over all frames, using the BVH's current world transform.
+        Equivalent to calling apply_frame() and root_joint.get_chain_worldspace_positions() for every frame, without modifying the skeleton.
+        :return: joint world positions of shape [frame_max_num, joint_num, 3], joints ordered as in get_joint_names()
+        """
+        scale_ms = np.stack([joint._scale_m for joint in self.skeleton.joints])
+        local_transforms = self.skeleton.translate_ms @ Quaternions(self.rot_data).to_rotation_matrices() @ scale_ms
 
-    def _apply_frame_rotations(self, joint: BVH_Joint, frame_num: int, ptr: npt.NDArray[np.int32]) -> None:
-        q = Quaternions(self.rot_data[frame_num, ptr])
-        joint.set_rotation(q)
+        # root joint's translation comes from the position data
+        local_transforms[:, 0, :-1, -1] = self.pos_data
 
-        ptr += 1
+        world_transforms = np.empty_like(local_transforms)
+        world_transforms[:, 0] = self.get_world_transform(copy=False) @ local_transforms[:, 0]
+        for joint_idx in range(1, self.joint_num):  # parents always precede children
+            world_transforms[:, joint_idx] = world_transforms[:, self.skeleton.parent_idxs[joint_idx]] @ local_transforms[:, joint_idx]
 
-        for c in joint.get_children():
-            if not isinstance(c, BVH_Joint):
-                continue
-            self._apply_frame_rotations(c, frame_num, ptr)
+        return world_transforms[..., :-1, -1]
+
+    def compute_skeleton_fwds(self, world_positions: npt.NDArray[np.float32], forward_perp_vector_joint_names: List[Tuple[str, str]]) -> npt.NDArray[np.float32]:
+        """
+        Batched version of get_skeleton_fwd().
+        :param world_positions: joint world positions of shape [frame_num, joint_num, 3], as returned by compute_world_positions()
+        :return: forward vector of the skeleton at each frame, shape [frame_num, 3]
+        """
+        name_to_idx = self.skeleton.name_to_idx
+
+        bone_vectors: List[npt.NDArray[np.float32]] = []
+        for (start_joint_name, end_joint_name) in forward_perp_vector_joint_names:
+            for joint_name in [start_joint_name, end_joint_name]:
+                if joint_name not in name_to_idx:
+                    msg = f'Could not find BVH joint with name: {joint_name}'
+                    logging.critical(msg)
+                    assert False, msg
+
+            bone_vector = Vectors(world_positions[:, name_to_idx[end_joint_name]] - world_positions[:, name_to_idx[start_joint_name]])
+            bone_vector.norm()
+            bone_vectors.append(bone_vector.vs)
+
+        return Vectors(np.mean(bone_vectors, axis=0)).perpendicular().vs
 
     def get_skeleton_fwd(self, forward_perp_vector_joint_names: List[Tuple[str, str]], update: bool = True) -> Vectors:
         """
@@ -108,13 +212,13 @@ class BVH(Transform, TimeManager):
 
         vectors_cw_perpendicular_to_fwd: List[Vectors] = []
         for (start_joint_name, end_joint_name) in forward_perp_vector_joint_names:
-            start_joint = self.root_joint.get_transform_by_name(start_joint_name)
+            start_joint = self.skeleton.get_joint_by_name(start_joint_name)
             if not start_joint:
                 msg = f'Could not find BVH joint with name: {start_joint_name}'
                 logging.critical(msg)
                 assert False, msg
 
-            end_joint = self.root_joint.get_transform_by_name(end_joint_name)
+            end_joint = self.skeleton.get_joint_by_name(end_joint_name)
             if not end_joint:
                 msg = f'Could not find BVH joint with name: {end_joint_name}'
                 logging.critical(msg)
@@ -137,34 +241,156 @@ class BVH(Transform, TimeManager):
         with open(str(bvh_p), 'r') as f:
             lines = f.read().splitlines()
 
-        if lines.pop(0) != 'HIERARCHY':
-            msg = f'Malformed BVH in line preceding {lines}'
+        # drop trailing blank lines
+        while lines and not lines[-1].strip():
+            lines.pop()
+
+        if not lines or lines[0].strip() != 'HIERARCHY':
+            msg = f'Malformed BVH {bvh_p}: first line must be HIERARCHY'
             logging.critical(msg)
             assert False, msg
 
         # Parse the skeleton
-        root_joint: BVH_Joint = BVH._parse_skeleton(lines)
+        root_joint: BVH_Joint
+        root_joint, line_idx = BVH._parse_skeleton(lines, 1)
+        skeleton = BVH_Skeleton(root_joint)
 
-        if lines.pop(0) != 'MOTION':
-            msg = f'Malformed BVH in line preceding {lines}'
+        if line_idx + 2 >= len(lines) or lines[line_idx].strip() != 'MOTION':
+            msg = f'Malformed BVH {bvh_p}: expected MOTION at line {line_idx + 1}'
             logging.critical(msg)
             assert False, msg
 
         # Parse motion metadata
-        frame_max_num = int(lines.pop(0).split(':')[-1])
-        frame_time = float(lines.pop(0).split(':')[-1])
+        frame_max_num = int(lines[line_idx + 1].split(':')[-1])
+        frame_time = float(lines[line_idx + 2].split(':')[-1])
 
-        # Parse motion data
-        frames = [list(map(float, line.strip().split(' '))) for line in lines]
-        if len(frames) != frame_max_num:
-            msg = f'framenum specified ({frame_max_num}) and found ({len(frames)}) do not match'
+        frame_lines: List[str] = lines[line_idx + 3:]
+        if len(frame_lines) != frame_max_num:
+            msg = f'framenum specified ({frame_max_num}) and found ({len(frame_lines)}) do not match'
+            logging.critical(msg)
+            assert False, msg
+
+        end_frame_idx = BVH._resolve_end_frame_idx(frame_max_num, end_frame_idx)
+
+        # Parse motion data in bulk, only for the frames between start and end frame indices
+        frame_lines = frame_lines[start_frame_idx:end_frame_idx]
+        channel_num: int = int(skeleton.channel_counts.sum())
+        try:
+            frames = np.array(' '.join(frame_lines).split(), dtype=np.float64)
+            frames = frames.reshape([len(frame_lines), channel_num]).astype(np.float32)
+        except ValueError as e:
+            msg = f'Malformed BVH {bvh_p}: could not parse motion data with {channel_num} channels per frame: {e}'
             logging.critical(msg)
             assert False, msg
 
         # Split logically distinct root position data from joint euler angle rotation data
         pos_data: npt.NDArray[np.float32]
         rot_data: npt.NDArray[np.float32]
-        pos_data, rot_data = BVH._process_frame_data(root_joint, frames)
+        pos_data, rot_data = BVH._process_frame_data(skeleton, frames)
+
+        # new frame_max_num based is end_frame_idx minus start_frame_idx
+        frame_max_num = end_frame_idx - start_frame_idx
+
+        return BVH(bvh_p.name, skeleton, frame_max_num, frame_time, pos_data, rot_data)
+
+    @classmethod
+    def from_compiled(cls, bvh_fn: str, start_frame_idx: int = 0, end_frame_idx: Optional[int] = None, mmap: bool = True) -> BVH:
+        """
+        Given a path to a file written by BVH.compile(), constructs and returns BVH object.
+        If mmap is true, pos_data and rot_data are read-only memory maps of the file rather than in-memory copies.
+        """
+        bvh_p: Path = resolve_ad_filepath(bvh_fn, 'compiled bvh file')
+        logging.info(f'Using compiled BVH file located at {bvh_p.resolve()}')
+
+        with open(str(bvh_p), 'rb') as f:
+            magic = f.read(len(BVH.COMPILED_MAGIC))
+            header_len = int.from_bytes(f.read(8), 'little')
+            try:
+                assert magic == BVH.COMPILED_MAGIC, 'not a compiled BVH file'
+                header = json.loads(f.read(header_len).decode('utf-8'))
+                assert header['version'] == BVH.COMPILED_VERSION, \
+                    f'compiled with version {header["version"]}, but version {BVH.COMPILED_VERSION} is required. Please recompile'
+            except (AssertionError, ValueError, KeyError) as e:
+                msg = f'Error loading compiled BVH {bvh_p}: {e}'
+                logging.critical(msg)
+                assert False, msg
+
+        arrays: Dict[str, npt.NDArray[np.float32]] = {}
+        for array_name, array_info in header['arrays'].items():
+            if mmap:
+                arrays[array_name] = np.memmap(str(bvh_p), dtype=array_info['dtype'], mode='r', offset=array_info['offset'], shape=tuple(array_info['shape']))
+            else:
+                with open(str(bvh_p), 'rb') as f:
+                    f.seek(array_info['offset'])
+                    count = int(np.prod(array_info['shape']))
+                    arrays[array_name] = np.fromfile(f, dtype=array_info['dtype'], count=count).reshape(array_info['shape'])
+
+        # rebuild skeleton. joints are stored in depth-first order, so parents precede their children
+        joints: List[BVH_Joint] = []
+        for joint_info in header['joints']:
+            joint = BVH_Joint(name=joint_info['name'], offset=Vectors(joint_info['offset']), channel_order=joint_info['channel_order'])
+            if joint_info['parent'] is not None:
+                joints[joint_info['parent']].add_child(joint)
+            joints.append(joint)
+
+        frame_max_num: int = header['frame_max_num']
+        end_frame_idx = BVH._resolve_end_frame_idx(frame_max_num, end_frame_idx)
+
+        pos_data = arrays['pos_data'][start_frame_idx:end_frame_idx]
+        rot_data = arrays['rot_data'][start_frame_idx:end_frame_idx]
+
+        return BVH(header['name'], BVH_Skeleton(joints[0]), end_frame_idx - start_frame_idx, header['frame_time'], pos_data, rot_data)
+
+    def compile(self, out_fn: str) -> None:
+        """
+        Writes skeleton, frame timing, and pos/rot data to out_fn, in a binary format that can be loaded
+        with BVH.from_compiled() without any parsing of motion data.
+        """
+        # skeleton is stored in depth-first order, with each joint's parent index
+        joints_info: List[Dict[str, Any]] = []
+        for joint_idx in range(self.joint_num):
+            parent_idx = int(self.skeleton.parent_idxs[joint_idx])
+            joints_info.append({
+                'name': self.skeleton.joint_names[joint_idx],
+                'parent': parent_idx if parent_idx >= 0 else None,
+                'offset': self.skeleton.offsets[joint_idx].tolist(),
+                'channel_order': self.skeleton.channel_orders[joint_idx],
+            })
+
+        arrays: Dict[str, npt.NDArray[np.float32]] = {
+            'pos_data': np.ascontiguousarray(self.pos_data, dtype='<f4'),
+            'rot_data': np.ascontiguousarray(self.rot_data, dtype='<f4'),
+        }
+
+        # header size determines array offsets and vice-versa, so reserve generous space for offsets up front
+        header: Dict[str, Any] = {
+            'version': BVH.COMPILED_VERSION,
+            'name': self.name,
+            'frame_max_num': self.frame_max_num,
+            'frame_time': self.frame_time,
+            'joints': joints_info,
+            'arrays': {name: {'dtype': '<f4', 'shape': list(array.shape), 'offset': 1 << 62} for name, array in arrays.items()},
+        }
+        data_start = len(BVH.COMPILED_MAGIC) + 8 + len(json.dumps(header).encode('utf-8'))
+        offset = data_start
+        for name, array in arrays.items():
+            offset = -(-offset // BVH._COMPILED_ALIGNMENT) * BVH._COMPILED_ALIGNMENT
+            header['arrays'][name]['offset'] = offset
+            offset += array.nbytes
+        header_bytes = json.dumps(header).encode('utf-8')
+        header_bytes += b' ' * (data_start - len(BVH.COMPILED_MAGIC) - 8 - len(header_bytes))  # pad to reserved size
+
+        with open(out_fn, 'wb') as f:
+            f.write(BVH.COMPILED_MAGIC)
+            f.write(len(header_bytes).to_bytes(8, 'little'))
+            f.write(header_bytes)
+            for name, array in arrays.items():
+                f.write(b'\x00' * (header['arrays'][name]['offset'] - f.tell()))
+                f.write(array.tobytes())
+
+    @classmethod
+    def _resolve_end_frame_idx(cls, frame_max_num: int, end_frame_idx: Optional[int]) -> int:
+        """ Returns end_frame_idx, replaced with frame_max_num if it was not passed in or exceeds frame_max_num """
 
         # Set end_frame if not passed in
         if not end_frame_idx:
@@ -176,109 +402,94 @@ class BVH(Transform, TimeManager):
             logging.warning(msg)
             end_frame_idx = frame_max_num
 
-        # slice position and rotation data using start and end frame indices
-        pos_data = pos_data[start_frame_idx:end_frame_idx, :]
-        rot_data = rot_data[start_frame_idx:end_frame_idx, :]
-
-        # new frame_max_num based is end_frame_idx minus start_frame_idx
-        frame_max_num = end_frame_idx - start_frame_idx
-
-        return BVH(bvh_p.name, root_joint, frame_max_num, frame_time, pos_data, rot_data)
+        return end_frame_idx
 
     @classmethod
-    def _parse_skeleton(cls, lines: List[str]) -> BVH_Joint:
+    def _parse_skeleton(cls, lines: List[str], line_idx: int) -> Tuple[BVH_Joint, int]:
         """
         Called recursively to parse and construct skeleton from BVH
-        :param lines: partially-processed contents of BVH file. Is modified in-place.
-        :return: Joint
+        :param lines: contents of BVH file
+        :param line_idx: index of the line where the joint's definition begins
+        :return: Joint and index of the line following the joint's definition
         """
 
+        def _next_line() -> str:
+            nonlocal line_idx
+            if line_idx >= len(lines):
+                msg = 'Malformed BVH. Reached end of file while parsing skeleton'
+                logging.critical(msg)
+                assert False, msg
+            line_idx += 1
+            return lines[line_idx - 1].strip()
+
         # Get the joint name
-        if lines[0].strip().startswith('ROOT'):
-            _, joint_name = lines.pop(0).strip().split(' ')
-        elif lines[0].strip().startswith('JOINT'):
-            _, joint_name = lines.pop(0).strip().split(' ')
-        elif lines[0].strip().startswith('End Site'):
-            joint_name = lines.pop(0).strip()
+        line = _next_line()
+        if line.startswith('ROOT') or line.startswith('JOINT'):
+            _, joint_name = line.split()
+        elif line.startswith('End Site'):
+            joint_name = line
         else:
-            msg = f'Malformed BVH. Line: {lines[0]}'
+            msg = f'Malformed BVH. Line {line_idx}: {line}'
             logging.critical(msg)
             assert False, msg
 
-        if lines.pop(0).strip() != '{':
-            msg = f'Malformed BVH in line preceding {lines}'
+        if _next_line() != '{':
+            msg = f'Malformed BVH. Expected {{ at line {line_idx}'
             logging.critical(msg)
             assert False, msg
 
         # Get offset
-        if not lines[0].strip().startswith('OFFSET'):
-            msg = f'Malformed BVH in line preceding {lines}'
+        line = _next_line()
+        if not line.startswith('OFFSET'):
+            msg = f'Malformed BVH. Expected OFFSET at line {line_idx}'
             logging.critical(msg)
             assert False, msg
-        _, *xyz = lines.pop(0).strip().split(' ')
+        _, *xyz = line.split()
         offset = Vectors(list(map(float, xyz)))
 
         # Get channels
-        if lines[0].strip().startswith('CHANNELS'):
-            channel_order = lines.pop(0).strip().split(' ')
-            _, channel_num, *channel_order = channel_order
+        if line_idx >= len(lines):
+            msg = f'Malformed BVH. Reached end of file after OFFSET of joint {joint_name}'
+            logging.critical(msg)
+            assert False, msg
+        channel_order: List[str]
+        if lines[line_idx].strip().startswith('CHANNELS'):
+            _, channel_num, *channel_order = _next_line().split()
         else:
             channel_num, channel_order = 0, []
         if int(channel_num) != len(channel_order):
-            msg = f'Malformed BVH in line preceding {lines}'
+            msg = f'Malformed BVH. Channel count mismatch at line {line_idx}'
             logging.critical(msg)
             assert False, msg
 
         # Recurse for children
         children: List[BVH_Joint] = []
-        while lines[0].strip() != '}':
-            children.append(BVH._parse_skeleton(lines))
-        lines.pop(0)  # }
+        while line_idx < len(lines) and lines[line_idx].strip() != '}':
+            child, line_idx = BVH._parse_skeleton(lines, line_idx)
+            children.append(child)
+        _next_line()  # }
 
-        return BVH_Joint(name=joint_name, offset=offset, channel_order=channel_order, children=children)
+        return BVH_Joint(name=joint_name, offset=offset, channel_order=channel_order, children=children), line_idx
 
     @classmethod
-    def _process_frame_data(cls, skeleton: BVH_Joint, frames: List[List[float]]) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.float32]]:
-        """ Given skeleton and frame data, return root position data and joint quaternion data, separately"""
-
-        def _get_frame_channel_order(joint: BVH_Joint, channels=[]):
-            channels.extend(joint.channel_order)
-            for child in [child for child in joint.get_children() if isinstance(child, BVH_Joint)]:
-                _get_frame_channel_order(child, channels)
-            return channels
-        channels = _get_frame_channel_order(skeleton)
+    def _process_frame_data(cls, skeleton: BVH_Skeleton, frames: npt.NDArray[np.float32]) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.float32]]:
+        """ Given skeleton and frame data [frame_num, channel_num], return root position data and joint quaternion data, separately"""
 
-        # create a mask so we retain only joint rotations and root position
-        mask = np.array(list(map(lambda x: True if 'rotation' in x else False, channels)))
-        mask[:3] = True  # hack to make sure we keep root position
+        channels = skeleton.get_channels()
 
-        frames = np.array(frames, dtype=np.float32)[:, mask]
+        # root position channels are the first three
+        pos_data = frames[:, :3]
 
-        # split root pose data and joint euler angle data
-        pos_data, ea_rots = np.split(np.array(frames, dtype=np.float32), [3], axis=1)
+        # gather each joint's euler angles into [frame_num, joint_num, 3], along with their rotation orders
+        axis_orders: List[str] = []
+        ea_rot_channel_idxs = np.zeros([skeleton.joint_num, 3], dtype=np.int32)
+        for joint_idx, channel_order in enumerate(skeleton.channel_orders):
+            channel_start = skeleton.channel_starts[joint_idx]
+            rot_channel_idxs = [channel_start + idx for idx, channel in enumerate(channel_order) if 'rotation' in channel]
+            axis_orders.append("".join([channels[idx][0].lower() for idx in rot_channel_idxs]))  # e.g. 'xyz'
+            ea_rot_channel_idxs[joint_idx, :len(rot_channel_idxs)] = rot_channel_idxs  # unused entries are ignored during conversion
+        ea_rots = frames[:, ea_rot_channel_idxs]
 
-        # quaternion rot data will go here
-        rot_data = np.empty([len(frames), skeleton.joint_count(), 4], dtype=np.float32)
-        BVH._pose_ea_to_q(skeleton, ea_rots, rot_data)
+        rot_data = Quaternions.from_euler_angles_batch(axis_orders, ea_rots).qs.astype(np.float32)
 
         return pos_data, rot_data
-
-    @classmethod
-    def _pose_ea_to_q(cls, joint: BVH_Joint, ea_rots: npt.NDArray[np.float32], q_rots: npt.NDArray[np.float32], p1: int = 0, p2: int = 0) -> Tuple[int, int]:
-        """
-        Given joint and array of euler angle rotation data, converts to quaternions and stores in q_rots.
-        Only called by _process_frame_data(). Modifies q_rots inplace.
-        :param p1: pointer to find where in ea_rots to read euler angles from
-        :param p2: pointer to determine where in q_rots to input quaternion
-        """
-        axis_chars = "".join([c[0].lower() for c in joint.channel_order if c.endswith('rotation')])  # e.g. 'xyz'
-
-        q_rots[:, p2] = Quaternions.from_euler_angles(axis_chars, ea_rots[:, p1:p1+len(axis_chars)]).qs
-        p1 += len(axis_chars)
-        p2 += 1
-
-        for child in joint.get_children():
-            if isinstance(child, BVH_Joint):
-                p1, p2 = BVH._pose_ea_to_q(child, ea_rots, q_rots, p1, p2)
-
-        return p1, p2
@@ -29,7 +29,7 @@ class Joint(Transform):
         return self._get_chain_worldspace_positions(self, [])
 
     def _get_chain_worldspace_positions(self, joint: Joint, position_list: List[float]) -> List[float]:
-        position_list.extend(joint.get_world_position(update_ancestors=False))
+        position_list.extend(joint.get_world_position(update_ancestors=False, copy=False))
         for c in joint.get_children():
             if not isinstance(c, Joint):
                 continue
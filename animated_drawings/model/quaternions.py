@@ -6,7 +6,7 @@ from __future__ import annotations  # so we can refer to class Type inside class
 import numpy as np
 import numpy.typing as npt
 import logging
-from typing import Union, Iterable, List, Tuple
+from typing import Union, Iterable, List, Tuple, Optional
 from animated_drawings.model.vectors import Vectors
 import math
 from animated_drawings.utils import TOLERANCE
@@ -20,7 +20,11 @@ class Quaternions:
     Strongly influenced by Daniel Holden's excellent Quaternions class.
     """
 
-    def __init__(self, qs: Union[Iterable[Union[int, float]], npt.NDArray[np.float32], Quaternions]) -> None:
+    def __init__(self, qs: Union[Iterable[Union[int, float]], npt.NDArray[np.float32], Quaternions], normalize: bool = True) -> None:
+        """
+        If qs are already known to be unit quaternions, pass normalize=False to skip normalization.
+        Constructing from an ndarray without normalizing does not copy it.
+        """
 
         self.qs: npt.NDArray[np.float32]
 
@@ -55,47 +59,67 @@ class Quaternions:
             logging.critical(msg)
             assert False, msg
 
-        self.normalize()
+        if normalize:
+            self.normalize()
 
     def normalize(self) -> None:
         self.qs = self.qs / np.expand_dims(np.sum(self.qs ** 2.0, axis=-1) ** 0.5, axis=-1)
 
-    def to_rotation_matrix(self) -> npt.NDArray[np.float32]:
+    def to_rotation_matrix(self, out: Optional[npt.NDArray[np.float32]] = None) -> npt.NDArray[np.float32]:
         """
         From Ken Shoemake
         https://www.ljll.math.upmc.fr/~frey/papers/scientific%20visualisation/Shoemake%20K.,%20Quaternions.pdf
+        :param out: optional 4x4 float32 array to write the result into, rather than allocating a new one
         :return: 4x4 rotation matrix representation of quaternions
         """
-        w = self.qs[..., 0].squeeze()
-        x = self.qs[..., 1].squeeze()
-        y = self.qs[..., 2].squeeze()
-        z = self.qs[..., 3].squeeze()
+        if self.qs.size != 4:
+            msg = f'to_rotation_matrix requires a single quaternion. Found shape {self.qs.shape}. Use to_rotation_matrices instead'
+            logging.critical(msg)
+            assert False, msg
 
-        xx, yy, zz = x**2, y**2, z**2
+        if out is None:
+            return self.to_rotation_matrices().reshape([4, 4])
+
+        self.to_rotation_matrices(out=out[np.newaxis])
+        return out
+
+    def to_rotation_matrices(self, out: Optional[npt.NDArray[np.float32]] = None) -> npt.NDArray[np.float32]:
+        """
+        Batched version of to_rotation_matrix().
+        :param out: optional float32 array of shape [*qs.shape[:-1], 4, 4] to write the result into, rather than allocating a new one
+        :return: array of shape [*qs.shape[:-1], 4, 4] containing the rotation matrix of each quaternion
+        """
+        w, x, y, z = self.qs[..., 0], self.qs[..., 1], self.qs[..., 2], self.qs[..., 3]
 
+        xx, yy, zz = x**2, y**2, z**2
         wx, wy, wz = w*x, w*y, w*z
-        xy, xz     = x*y, x*z  # no
-        yz         = y*z
+        xy, xz, yz = x*y, x*z, y*z
+
+        m: npt.NDArray[np.float32]
+        if out is None:
+            m = np.zeros([*self.qs.shape[:-1], 4, 4], dtype=np.float32)
+            m[..., 3, 3] = 1.0
+        else:
+            m = out
+            m[..., 3, :] = [0.0, 0.0, 0.0, 1.0]
+            m[..., :3, 3] = 0.0
 
         # Row 1
-        r00 = 1 - 2 * (yy + zz)
-        r01 = 2 * (xy - wz)
-        r02 = 2 * (xz + wy)
+        m[..., 0, 0] = 1 - 2 * (yy + zz)
+        m[..., 0, 1] = 2 * (xy - wz)
+        m[..., 0, 2] = 2 * (xz + wy)
 
         # Row 2
-        r10 = 2 * (xy + wz)
-        r11 = 1 - 2 * (xx + zz)
-        r12 = 2 * (yz - wx)
+        m[..., 1, 0] = 2 * (xy + wz)
+        m[..., 1, 1] = 1 - 2 * (xx + zz)
+        m[..., 1, 2] = 2 * (yz - wx)
 
         # Row 3
-        r20 = 2 * (xz - wy)
-        r21 = 2 * (yz + wx)
-        r22 = 1 - 2 * (xx + yy)
+        m[..., 2, 0] = 2 * (xz - wy)
+        m[..., 2, 1] = 2 * (yz + wx)
+        m[..., 2, 2] = 1 - 2 * (xx + yy)
 
-        return np.array([[r00, r01, r02, 0.0],
-                         [r10, r11, r12, 0.0],
-                         [r20, r21, r22, 0.0],
-                         [0.0, 0.0, 0.0, 1.0]], dtype=np.float32)
+        return m
 
     @classmethod
     def rotate_between_vectors(cls, v1: Vectors, v2: Vectors) -> Quaternions:
@@ -159,6 +183,54 @@ class Quaternions:
         ret_q = reduce(lambda a, b: b * a, _quats)
         return ret_q
 
+    @classmethod
+    def from_euler_angles_batch(cls, orders: List[str], angles: npt.NDArray[np.float32]) -> Quaternions:
+        """
+        Converts euler angles of many joints, each with its own rotation order, at once. Joints sharing an order are converted together.
+        Results match calling from_euler_angles() on each joint separately.
+        :param orders: for each joint, string comprised of x, y, and/or z (at most 3 chars). Empty string gives identity.
+        :param angles: angles in degrees, shape [..., joint_num, 3]. For each joint, only the first len(order) angles are used
+        :return: Quaternions of shape [..., joint_num, 4]
+        """
+        if angles.shape[-2] != len(orders) or angles.shape[-1] != 3:
+            msg = f'angles must have shape [..., {len(orders)}, 3]. Found {angles.shape}'
+            logging.critical(msg)
+            assert False, msg
+
+        half_angles: npt.NDArray[np.float64] = angles.astype(np.float64) * (np.pi / 360)
+        ss, cs = np.sin(half_angles), np.cos(half_angles)
+
+        qs = np.zeros([*angles.shape[:-1], 4], dtype=np.float64)
+        qs[..., 0] = 1.0
+        for order in set(orders):
+            if len(order) > 3 or any(axis_char not in 'xyz' for axis_char in order.lower()):
+                msg = f'unsupported order: {order}'
+                logging.critical(msg)
+                assert False, msg
+
+            joint_idxs = [idx for idx, joint_order in enumerate(orders) if joint_order == order]
+
+            # accumulate q = q_0 * q_1 * ... where q_i rotates about the i-th axis of order
+            w = np.ones([*angles.shape[:-2], len(joint_idxs)])
+            xyz = np.zeros([*angles.shape[:-2], len(joint_idxs), 3])
+            for pos, axis_char in enumerate(order.lower()):
+                axis = ord(axis_char) - ord('x')
+                s, c = ss[..., joint_idxs, pos], cs[..., joint_idxs, pos]
+
+                # product with a quaternion whose only nonzero vector component is along axis
+                a1, a2 = (axis + 1) % 3, (axis + 2) % 3
+                w_new = w * c - xyz[..., axis] * s
+                xyz_new = np.empty_like(xyz)
+                xyz_new[..., axis] = xyz[..., axis] * c + w * s
+                xyz_new[..., a1] = xyz[..., a1] * c + xyz[..., a2] * s
+                xyz_new[..., a2] = xyz[..., a2] * c - xyz[..., a1] * s
+                w, xyz = w_new, xyz_new
+
+            qs[..., joint_idxs, 0] = w
+            qs[..., joint_idxs, 1:] = xyz
+
+        return Quaternions(qs)
+
     @classmethod
     def from_rotation_matrix(cls, M: npt.NDArray[np.float32]) -> Quaternions:
         """
@@ -202,6 +274,84 @@ class Quaternions:
         ret_q.normalize()
         return ret_q
 
+    @classmethod
+    def from_rotation_matrices(cls, M: npt.NDArray[np.float32]) -> Quaternions:
+        """
+        Batched version of from_rotation_matrix().
+        :param M: rotation matrices of shape [..., 4, 4] or [..., 3, 3]
+        :return: Quaternions of shape [..., 4]
+        """
+        if M.shape[-2:] not in [(4, 4), (3, 3)]:
+            msg = f'rotation matrices must have shape [..., 4, 4] or [..., 3, 3]. Found: {M.shape}'
+            logging.critical(msg)
+            assert False, msg
+
+        R = M[..., :3, :3].astype(np.float64)
+        is_orthogonal = np.isclose(R @ np.swapaxes(R, -1, -2), np.identity(3), atol=TOLERANCE)
+        if not is_orthogonal.all():
+            msg = "attempted to create quaternion from non-orthogonal rotation matrix"
+            logging.critical(msg)
+            assert False, msg
+
+        if not np.isclose(np.linalg.det(R), 1.0).all():
+            msg = "attempted to create quaternion from rotation matrix with det != 1"
+            logging.critical(msg)
+            assert False, msg
+
+        # same method as from_rotation_matrix(), evaluating every branch and selecting per matrix
+        MT = np.swapaxes(R, -1, -2)
+        m00, m01, m02 = MT[..., 0, 0], MT[..., 0, 1], MT[..., 0, 2]
+        m10, m11, m12 = MT[..., 1, 0], MT[..., 1, 1], MT[..., 1, 2]
+        m20, m21, m22 = MT[..., 2, 0], MT[..., 2, 1], MT[..., 2, 2]
+
+        t0 = 1 + m00 - m11 - m22
+        t1 = 1 - m00 + m11 - m22
+        t2 = 1 - m00 - m11 + m22
+        t3 = 1 + m00 + m11 + m22
+        q0 = np.stack([m12-m21,      t0, m01+m10, m20+m02], axis=-1)
+        q1 = np.stack([m20-m02, m01+m10,      t1, m12+m21], axis=-1)
+        q2 = np.stack([m01-m10, m20+m02, m12+m21,      t2], axis=-1)
+        q3 = np.stack([     t3, m12-m21, m20-m02, m01-m10], axis=-1)
+
+        branch = np.where(m22 < 0, np.where(m00 > m11, 0, 1), np.where(m00 < -m11, 2, 3))
+        t = np.choose(branch, [t0, t1, t2, t3])
+        q = np.choose(branch[..., np.newaxis], [q0, q1, q2, q3])
+        q *= np.expand_dims(0.5 / np.sqrt(t), axis=-1)
+
+        return Quaternions(q)
+
+    @classmethod
+    def nlerp(cls, q0: Quaternions, q1: Quaternions, t: Union[float, npt.NDArray[np.float32]]) -> Quaternions:
+        """
+        Normalized linear interpolation from q0 (t=0) to q1 (t=1) along the shorter arc.
+        q0, q1, and t (of shape q.shape[:-1], if not a float) are broadcast against each other.
+        """
+        t = np.expand_dims(np.asarray(t), axis=-1)
+        sign = np.sign(np.sum(q0.qs * q1.qs, axis=-1, keepdims=True))
+        sign = np.where(sign == 0, 1.0, sign)
+        return Quaternions((1 - t) * q0.qs + t * sign * q1.qs)
+
+    @classmethod
+    def slerp(cls, q0: Quaternions, q1: Quaternions, t: Union[float, npt.NDArray[np.float32]]) -> Quaternions:
+        """
+        Spherical linear interpolation from q0 (t=0) to q1 (t=1) along the shorter arc.
+        q0, q1, and t (of shape q.shape[:-1], if not a float) are broadcast against each other.
+        Falls back to nlerp where quaternions are nearly identical.
+        """
+        t = np.expand_dims(np.asarray(t), axis=-1)
+        dot = np.sum(q0.qs * q1.qs, axis=-1, keepdims=True)
+        q1s = np.where(dot < 0, -q1.qs, q1.qs)
+        dot = np.clip(np.abs(dot), 0.0, 1.0)
+
+        theta = np.arccos(dot)
+        sin_theta = np.sin(theta)
+        is_close = sin_theta < TOLERANCE
+        safe_sin_theta = np.where(is_close, 1.0, sin_theta)
+        w0 = np.where(is_close, 1 - t, np.sin((1 - t) * theta) / safe_sin_theta)
+        w1 = np.where(is_close, t, np.sin(t * theta) / safe_sin_theta)
+
+        return Quaternions(w0 * q0.qs + w1 * q1s)
+
     def __mul__(self, other: Quaternions):
         """
         From https://danceswithcode.net/engineeringnotes/quaternions/quaternions.html
@@ -6,10 +6,9 @@ import logging
 from animated_drawings.model.bvh import BVH
 import numpy as np
 import numpy.typing as npt
-import math
 from animated_drawings.model.joint import Joint
 from sklearn.decomposition import PCA
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Optional, TypedDict
 from animated_drawings.model.vectors import Vectors
 from animated_drawings.model.quaternions import Quaternions
 from animated_drawings.config import MotionConfig, RetargetConfig
@@ -18,6 +17,17 @@ x_axis = np.array([1.0, 0.0, 0.0], dtype=np.float32)
 z_axis = np.array([0.0, 0.0, 1.0], dtype=np.float32)
 
 
+class RetargetedMotion(TypedDict):
+    """ The character-independent results of retargeting a BVH, which Retargeters using the same motion can share. """
+    bvh: BVH
+    joint_positions: npt.NDArray[np.float32]
+    fwd_vectors: npt.NDArray[np.float32]
+    bvh_root_positions: npt.NDArray[np.float32]
+    joint_group_name_to_projection_plane: Dict[str, npt.NDArray[np.float32]]
+    joint_to_projection_plane: Dict[str, npt.NDArray[np.float32]]
+    bvh_joint_depths: npt.NDArray[np.float32]
+
+
 class Retargeter():
     """
     Retargeter class takes in a motion_cfg file and retarget_cfg file.
@@ -27,11 +37,139 @@ class Retargeter():
     bone orientations, joint 'depths', and root offsets for each frame.
     """
 
-    def __init__(self, motion_cfg: MotionConfig, retarget_cfg: RetargetConfig) -> None:
+    def __init__(self, motion_cfg: MotionConfig, retarget_cfg: RetargetConfig, load_motion: bool = True,
+                 motion_cache: Optional[Dict[str, RetargetedMotion]] = None) -> None:
+        """
+        If load_motion is False, the BVH is not loaded or retargeted until the bvh property is first accessed.
+        The per-frame data must instead be provided with set_retargeted_data(), e.g. from a disk cache.
+        Retargeters given the same motion_cache share the character-independent results of retargeting the same motion.
+        """
+
+        # bvh joints defining a set of vectors that skeleton's fwd is perpendicular to
+        self.forward_perp_vector_joint_names: List[Tuple[str, str]] = motion_cfg.forward_perp_joint_vectors
+
+        # kept so the motion can be loaded later if it is not loaded now
+        self._motion_cfg: MotionConfig = motion_cfg
+        self._retarget_cfg: RetargetConfig = retarget_cfg
+        self._motion_cache: Optional[Dict[str, RetargetedMotion]] = motion_cache
+
+        self._bvh: Optional[BVH] = None
+        self.joint_positions: npt.NDArray[np.float32]
+        self.fwd_vectors: npt.NDArray[np.float32]
+        self.bvh_root_positions: npt.NDArray[np.float32]
+        self.joint_group_name_to_projection_plane: Dict[str, npt.NDArray[np.float32]]
+        self.joint_to_projection_plane: Dict[str, npt.NDArray[np.float32]]
+        self.bvh_joint_depths: npt.NDArray[np.float32]
+        self.bvh_joint_names: List[str]
+
+        # map bvh joint names to its distance to project plane. Values are column views into bvh_joint_depths
+        self.bvh_joint_to_projection_depth: Dict[str, npt.NDArray[np.float32]]
+
+        # seconds per frame and number of frames of the retargeted motion
+        self.frame_time: float
+        self.frame_max_num: int
+
+        if load_motion:
+            self._load_or_initialize_motion()
 
-        # instantiate the bvh
+        # cache the starting worldspace location of character's root joint
+        self.character_start_loc: npt.NDArray[np.float32] = np.array(retarget_cfg.char_start_loc, dtype=np.float32)
+
+        # holds world coordinates of character root joint after retargeting
+        self.char_root_positions: npt.NDArray[np.float32]
+
+        # map character joint names to its orientations
+        self.char_joint_to_orientation: Dict[str, npt.NDArray[np.float32]] = {}
+
+        # [F, J] orientations, columns ordered by the character's joints. Built by set_char_joint_order()
+        self.char_joint_orientations: npt.NDArray[np.float32]
+
+    @property
+    def bvh(self) -> BVH:
+        """ The retargeted BVH. If the motion was not loaded at construction, it is loaded now. """
+        if self._bvh is None:
+            self._load_or_initialize_motion()
+        assert self._bvh is not None  # for static analysis
+        return self._bvh
+
+    def set_retargeted_data(self, frame_time: float, char_joint_orientations: npt.NDArray[np.float32],
+                            bvh_joint_depths: npt.NDArray[np.float32], char_root_positions: npt.NDArray[np.float32]) -> None:
+        """ Uses per-frame retargeting results computed previously, rather than computing them from the motion. """
+        self.frame_time = frame_time
+        self.frame_max_num = char_root_positions.shape[0]
+        self.char_joint_orientations = char_joint_orientations
+        self.bvh_joint_depths = bvh_joint_depths
+        self.char_root_positions = char_root_positions
+
+    def _load_or_initialize_motion(self) -> None:
+        """ Load, orient, and project the motion, unless another Retargeter sharing the motion cache has already done so """
+        if self._motion_cache is None:
+            self._initialize_motion(self._motion_cfg, self._retarget_cfg)
+        else:
+            motion_cache_key = self._get_motion_cache_key(self._motion_cfg, self._retarget_cfg)
+            if motion_cache_key in self._motion_cache:
+                self._load_motion(self._motion_cache[motion_cache_key])
+            else:
+                self._initialize_motion(self._motion_cfg, self._retarget_cfg)
+                self._motion_cache[motion_cache_key] = {
+                    'bvh': self.bvh,
+                    'joint_positions': self.joint_positions,
+                    'fwd_vectors': self.fwd_vectors,
+                    'bvh_root_positions': self.bvh_root_positions,
+                    'joint_group_name_to_projection_plane': self.joint_group_name_to_projection_plane,
+                    'joint_to_projection_plane': self.joint_to_projection_plane,
+                    'bvh_joint_depths': self.bvh_joint_depths,
+                }
+
+        self.frame_time = self.bvh.frame_time
+        self.frame_max_num = self.bvh.frame_max_num
+
+        self.bvh_joint_to_projection_depth = {
+            joint_name: self.bvh_joint_depths[:, idx] for idx, joint_name in enumerate(self.bvh_joint_names) if joint_name in self.joint_to_projection_plane}
+
+    @staticmethod
+    def _get_motion_cache_key(motion_cfg: MotionConfig, retarget_cfg: RetargetConfig) -> str:
+        """ Returns a key identifying everything the character-independent part of retargeting depends upon. """
+        bvh_stat = motion_cfg.bvh_p.stat()  # so an edited motion file is not mistaken for the original
+        return repr((
+            str(motion_cfg.bvh_p.resolve()),
+            bvh_stat.st_mtime_ns,
+            bvh_stat.st_size,
+            motion_cfg.start_frame_idx,
+            motion_cfg.end_frame_idx,
+            motion_cfg.frame_time,
+            motion_cfg.scale,
+            motion_cfg.up,
+            motion_cfg.groundplane_joint,
+            motion_cfg.forward_perp_joint_vectors,
+            retarget_cfg.bvh_projection_bodypart_groups,
+        ))
+
+    def _load_motion(self, motion: RetargetedMotion) -> None:
+        """ Uses the results of a previous Retargeter's _initialize_motion(). The arrays are shared and must not be modified. """
+        self._bvh = motion['bvh']
+        self.bvh_joint_names = self.bvh.get_joint_names()
+        self.joint_positions = motion['joint_positions']
+        self.fwd_vectors = motion['fwd_vectors']
+        self.bvh_root_positions = motion['bvh_root_positions']
+        self.joint_group_name_to_projection_plane = dict(motion['joint_group_name_to_projection_plane'])
+        self.joint_to_projection_plane = dict(motion['joint_to_projection_plane'])
+        self.bvh_joint_depths = motion['bvh_joint_depths']
+
+        # the shared bvh may have since been animated; pose it as _initialize_motion() leaves it
+        self.bvh.apply_frame(self.bvh.frame_max_num - 1)
+
+    def _initialize_motion(self, motion_cfg: MotionConfig, retarget_cfg: RetargetConfig) -> None:
+        """
+        Loads the BVH and computes everything that does not depend upon the character:
+        normalized joint positions, forward vectors, projection planes, and joint depths.
+        """
+        # instantiate the bvh, from the compiled format if that is what was specified
         try:
-            self.bvh = BVH.from_file(str(motion_cfg.bvh_p), motion_cfg.start_frame_idx, motion_cfg.end_frame_idx)
+            if motion_cfg.bvh_p.suffix == BVH.COMPILED_SUFFIX:
+                self._bvh = BVH.from_compiled(str(motion_cfg.bvh_p), motion_cfg.start_frame_idx, motion_cfg.end_frame_idx)
+            else:
+                self._bvh = BVH.from_file(str(motion_cfg.bvh_p), motion_cfg.start_frame_idx, motion_cfg.end_frame_idx)
         except Exception as e:
             msg = f'Error loading BVH: {e}'
             logging.critical(msg)
@@ -40,9 +178,6 @@ class Retargeter():
         # get and cache bvh joint names for later
         self.bvh_joint_names = self.bvh.get_joint_names()
 
-        # bvh joints defining a set of vectors that skeleton's fwd is perpendicular to
-        self.forward_perp_vector_joint_names: List[Tuple[str, str]] = motion_cfg.forward_perp_joint_vectors
-
         # override the frame_time, if one was specified within motion_cfg
         if motion_cfg.frame_time:
             self.bvh.frame_time = motion_cfg.frame_time
@@ -70,7 +205,7 @@ class Retargeter():
 
         # adjust bvh skeleton y pos by getting groundplane joint...
         try:
-            groundplane_joint = self.bvh.root_joint.get_transform_by_name(motion_cfg.groundplane_joint)
+            groundplane_joint = self.bvh.skeleton.get_joint_by_name(motion_cfg.groundplane_joint)
             assert isinstance(groundplane_joint, Joint), f'could not find joint by name: {motion_cfg.groundplane_joint}'
         except Exception as e:
             msg = f'Error getting groundplane joint: {e}'
@@ -81,20 +216,11 @@ class Retargeter():
         bvh_groundplane_y = groundplane_joint.get_world_position()[1]
         self.bvh.offset(np.array([0, -bvh_groundplane_y, 0]))
 
-        self.joint_positions: npt.NDArray[np.float32]
-        self.fwd_vectors: npt.NDArray[np.float32]
-        self.bvh_root_positions: npt.NDArray[np.float32]
         self._compute_normalized_joint_positions_and_fwd_vectors()
 
-        # cache the starting worldspace location of character's root joint
-        self.character_start_loc: npt.NDArray[np.float32] = np.array(retarget_cfg.char_start_loc, dtype=np.float32)
-
-        # holds world coordinates of character root joint after retargeting
-        self.char_root_positions: npt.NDArray[np.float32]
-
         # get & save projection planes
-        self.joint_group_name_to_projection_plane: Dict[ str, npt.NDArray[np.float32]] = {}
-        self.joint_to_projection_plane: Dict[ str, npt.NDArray[np.float32]] = {}
+        self.joint_group_name_to_projection_plane = {}
+        self.joint_to_projection_plane = {}
         for joint_projection_group in retarget_cfg.bvh_projection_bodypart_groups:
             group_name = joint_projection_group['name']
             joint_names = joint_projection_group['bvh_joint_names']
@@ -106,11 +232,9 @@ class Retargeter():
             for joint_name in joint_projection_group['bvh_joint_names']:
                 self.joint_to_projection_plane[joint_name] = projection_plane
 
-        # map character joint names to its orientations
-        self.char_joint_to_orientation: Dict[str, npt.NDArray[np.float32]] = {}
-
-        # map bvh joint names to its distance to project plane (useful for rendering order)
-        self.bvh_joint_to_projection_depth: Dict[str, npt.NDArray[np.float32]] = self._compute_depths()
+        # [F, J] distance of each bvh joint to its projection plane (useful for rendering order), columns ordered as bvh_joint_names.
+        # Joints without a projection plane are NaN.
+        self.bvh_joint_depths = self._compute_depths()
 
     def _compute_normalized_joint_positions_and_fwd_vectors(self) -> None:
         """
@@ -120,13 +244,13 @@ class Retargeter():
         Repositions them so root is above the origin.
         Rotates them so skeleton faces along the +X axis.
         """
-        # get joint positions and forward vectors
-        self.joint_positions = np.empty([self.bvh.frame_max_num, 3 * self.bvh.joint_num], dtype=np.float32)
-        self.fwd_vectors = np.empty([self.bvh.frame_max_num, 3], dtype=np.float32)
-        for frame_idx in range(self.bvh.frame_max_num):
-            self.bvh.apply_frame(frame_idx)
-            self.joint_positions[frame_idx] = self.bvh.root_joint.get_chain_worldspace_positions()
-            self.fwd_vectors[frame_idx] = self.bvh.get_skeleton_fwd(self.forward_perp_vector_joint_names).vs[0]
+        # get joint positions and forward vectors for all frames at once
+        world_positions: npt.NDArray[np.float32] = self.bvh.compute_world_positions()
+        self.joint_positions = world_positions.reshape([self.bvh.frame_max_num, 3 * self.bvh.joint_num])
+        self.fwd_vectors = self.bvh.compute_skeleton_fwds(world_positions, self.forward_perp_vector_joint_names).astype(np.float32)
+
+        # leave the skeleton posed at the final frame, as frame-by-frame computation did
+        self.bvh.apply_frame(self.bvh.frame_max_num - 1)
 
         # reposition over origin
         self.bvh_root_positions = self.joint_positions[:, :3]
@@ -141,16 +265,18 @@ class Retargeter():
         angle %= 2*np.pi
         angle = np.where(angle < 0.0, angle + 2*np.pi, angle)
 
-        # rotate the skeleton's joint so it faces +X axis
-        for idx in range(self.joint_positions.shape[0]):
-            rot_mat = np.identity(3).astype(np.float32)
-            rot_mat[0, 0] = math.cos(angle[idx])
-            rot_mat[0, 2] = math.sin(angle[idx])
-            rot_mat[2, 0] = -math.sin(angle[idx])
-            rot_mat[2, 2] = math.cos(angle[idx])
+        # rotate the skeleton's joint so it faces +X axis, using one rotation about the y axis per frame
+        cos = np.cos(angle.astype(np.float64)).astype(np.float32)
+        sin = np.sin(angle.astype(np.float64)).astype(np.float32)
+        rot_mats = np.zeros([self.joint_positions.shape[0], 3, 3], dtype=np.float32)
+        rot_mats[:, 0, 0] = cos
+        rot_mats[:, 0, 2] = sin
+        rot_mats[:, 1, 1] = 1.0
+        rot_mats[:, 2, 0] = -sin
+        rot_mats[:, 2, 2] = cos
 
-            rotated_joints: npt.NDArray[np.float32] = rot_mat @ self.joint_positions[idx].reshape([-1, 3]).T
-            self.joint_positions[idx] = rotated_joints.T.reshape(self.joint_positions[idx].shape)
+        frame_joint_positions = self.joint_positions.reshape([self.joint_positions.shape[0], -1, 3])
+        self.joint_positions = np.einsum('fij,fkj->fki', rot_mats, frame_joint_positions).reshape(self.joint_positions.shape)
 
     def _determine_projection_plane_normal(self, group_name: str, joint_names: List[str], projection_method: str) -> npt.NDArray[np.float32]:
         """
@@ -197,16 +323,16 @@ class Retargeter():
             logging.info(f'PCA complete. {group_name} using {z_axis}')
             return z_axis
 
-    def _compute_depths(self) -> Dict[str, npt.NDArray[np.float32]]:
+    def _compute_depths(self) -> npt.NDArray[np.float32]:
         """
         For each BVH joint within bvh_projection_mapping_groups, compute distance to projection plane.
         This distance used if the joint is a char_body_segmentation_groups depth_driver.
+        Returns [F, J] array with columns ordered as bvh_joint_names; joints without a projection plane are NaN.
         """
 
-        bvh_joint_to_projection_depth: Dict[str, npt.NDArray[np.float32]] = {}
+        bvh_joint_depths = np.full([self.joint_positions.shape[0], len(self.bvh_joint_names)], np.nan, dtype=np.float32)
 
-        for joint_name in self.bvh_joint_names:
-            joint_idx = self.bvh_joint_names.index(joint_name)
+        for joint_idx, joint_name in enumerate(self.bvh_joint_names):
             joint_xyz = self.joint_positions[:, 3*joint_idx:3*(joint_idx+1)]
             try:
                 projection_plane_normal = self.joint_to_projection_plane[joint_name]
@@ -217,16 +343,15 @@ class Retargeter():
 
             # project bone onto 2D plane
             if np.array_equal(projection_plane_normal, x_axis):
-                joint_depths = joint_xyz[:, 0]
+                bvh_joint_depths[:, joint_idx] = joint_xyz[:, 0]
             elif np.array_equal(projection_plane_normal, z_axis):
-                joint_depths = joint_xyz[:, 2]
+                bvh_joint_depths[:, joint_idx] = joint_xyz[:, 2]
             else:
                 msg = 'error projection_plane_normal'
                 logging.critical(msg)
                 assert False, msg
-            bvh_joint_to_projection_depth[joint_name] = joint_depths
 
-        return bvh_joint_to_projection_depth
+        return bvh_joint_depths
 
     def scale_root_positions_for_character(self, char_to_bvh_scale: float, projection_bodypart_group_for_offset: str) -> None:
         """
@@ -240,20 +365,20 @@ class Retargeter():
             logging.critical(msg)
             assert False, msg
 
-        self.char_root_positions = np.empty([self.bvh_root_positions.shape[0], 2], dtype=np.float32)
-        self.char_root_positions[0] = [0, 0]
-        for idx in range(1, self.bvh_root_positions.shape[0]):
+        if np.array_equal(projection_plane, np.array([0.0, 0.0, 1.0])):              # if sagittal projection
+            v1 = self.fwd_vectors[1:]                                               # we're interested in forward motion
+        else:                                                                       # if frontal projection
+            v1 = self.fwd_vectors[1:, ::-1] * np.array([-1, 1, -1])                 # we're interested in lateral motion
 
-            if np.array_equal(projection_plane, np.array([0.0, 0.0, 1.0])):  # if sagittal projection
-                v1 = self.fwd_vectors[idx]                                   # we're interested in forward motion
-            else:                                                            # if frontal projection
-                v1 = self.fwd_vectors[idx][::-1]*np.array([-1, 1, -1])       # we're interested in lateral motion
+        deltas = np.diff(self.bvh_root_positions, axis=0)
 
-            delta = self.bvh_root_positions[idx] - self.bvh_root_positions[idx-1]
+        # scale root deltas for both x and y offsets. Project onto v1 for x offset, then accumulate over frames
+        char_root_deltas = np.empty([deltas.shape[0], 2], dtype=np.float64)
+        char_root_deltas[:, 0] = char_to_bvh_scale * np.einsum('fi,fi->f', v1, deltas)  # x
+        char_root_deltas[:, 1] = char_to_bvh_scale * deltas[:, 1]                        # y
 
-            # scale root delta for both x and y offsets. Project onto v1 for x offset
-            self.char_root_positions[idx, 0] = self.char_root_positions[idx-1, 0] + char_to_bvh_scale * np.dot(v1, delta)  # x
-            self.char_root_positions[idx, 1] = self.char_root_positions[idx-1, 1] + char_to_bvh_scale * delta[1]           # y
+        self.char_root_positions = np.zeros([self.bvh_root_positions.shape[0], 2], dtype=np.float32)
+        self.char_root_positions[1:] = np.cumsum(char_root_deltas, axis=0)
 
     def compute_orientations(self, bvh_prox_joint_name: str, bvh_dist_joint_name: str, char_joint_name: str) -> None:
         """
@@ -262,14 +387,14 @@ class Retargeter():
         """
 
         # get distal end joint
-        dist_joint = self.bvh.root_joint.get_transform_by_name(bvh_dist_joint_name)
+        dist_joint = self.bvh.skeleton.get_joint_by_name(bvh_dist_joint_name)
         if dist_joint is None or not isinstance(dist_joint, Joint) or dist_joint.name is None:
             msg = 'error finding joint {bvh_dist_joint_name}'
             logging.critical(msg)
             assert False, msg
 
         # get prox joint
-        prox_joint = self.bvh.root_joint.get_transform_by_name(bvh_prox_joint_name)
+        prox_joint = self.bvh.skeleton.get_joint_by_name(bvh_prox_joint_name)
         if prox_joint is None or not isinstance(prox_joint, Joint) or prox_joint.name is None:
             msg = 'joint {bvh_prox_joint_name} has no parent joint, therefore no bone orientation. Returning zero'
             logging.info(msg)
@@ -317,27 +442,43 @@ class Retargeter():
         # save it
         self.char_joint_to_orientation[char_joint_name] = np.array(theta)
 
-    def get_retargeted_frame_data(self, time: float) -> Tuple[Dict[str, float], Dict[str, float], npt.NDArray[np.float32]]:
+    def set_char_joint_order(self, char_joint_names: List[str]) -> None:
         """
-        Input: time, in seconds, used to select the correct BVH frame.
-        Calculate the proper frame and, for it, returns:
-            - orientations, dictionary mapping from character joint names to world orientations (degrees CCW from +Y axis)
-            - joint_depths, dictionary mapping from BVH skeleton's joint names to distance from joint to projection plane
-            - root_positions, the position of the character's root at this frame.
+        Stacks the orientations computed by compute_orientations() into char_joint_orientations, a [F, J] array
+        whose columns follow char_joint_names. Joints without an orientation are NaN.
         """
-        frame_idx = int(round(time / self.bvh.frame_time, 0))
+        self.char_joint_orientations = np.full([self.joint_positions.shape[0], len(char_joint_names)], np.nan, dtype=np.float32)
+        for idx, char_joint_name in enumerate(char_joint_names):
+            if char_joint_name in self.char_joint_to_orientation:
+                self.char_joint_orientations[:, idx] = self.char_joint_to_orientation[char_joint_name]
+
+    def get_frame_idx(self, time: float) -> int:
+        """ Input: time, in seconds. Returns the index of the BVH frame to use at that time, clamped to the valid frame range. """
+        frame_idx = int(round(time / self.frame_time, 0))
 
         if frame_idx < 0:
             logging.info(f'invalid frame_idx ({frame_idx}), replacing with 0')
             frame_idx = 0
 
-        if self.bvh.frame_max_num <= frame_idx:
-            logging.info(f'invalid frame_idx ({frame_idx}), replacing with last frame {self.bvh.frame_max_num-1}')
-            frame_idx = self.bvh.frame_max_num-1
+        if self.frame_max_num <= frame_idx:
+            logging.info(f'invalid frame_idx ({frame_idx}), replacing with last frame {self.frame_max_num-1}')
+            frame_idx = self.frame_max_num-1
+
+        return frame_idx
+
+    def get_retargeted_frame_data(self, time: float) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.float32], npt.NDArray[np.float32]]:
+        """
+        Input: time, in seconds, used to select the correct BVH frame.
+        Calculate the proper frame and, for it, returns:
+            - orientations, [J] view of char_joint_orientations: world orientation of each character joint (degrees CCW from +Y axis)
+            - joint_depths, [J] view of bvh_joint_depths: distance from each BVH joint to projection plane
+            - root_positions, the position of the character's root at this frame.
+        """
+        frame_idx = self.get_frame_idx(time)
 
-        orientations = {key: val[frame_idx] for (key, val) in self.char_joint_to_orientation.items()}
+        orientations = self.char_joint_orientations[frame_idx]
 
-        joint_depths = {key: val[frame_idx] for (key, val) in self.bvh_joint_to_projection_depth.items()}
+        joint_depths = self.bvh_joint_depths[frame_idx]
 
         root_position = np.array([self.char_root_positions[frame_idx, 0], self.char_root_positions[frame_idx, 1], 0.0], dtype=np.float32)
         root_position += self.character_start_loc  # offset by character's starting location
@@ -2,11 +2,13 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+from typing import Dict
 from animated_drawings.model.transform import Transform
 from animated_drawings.model.time_manager import TimeManager
 from animated_drawings.config import SceneConfig
 from animated_drawings.model.floor import Floor
 from animated_drawings.model.animated_drawing import AnimatedDrawing
+from animated_drawings.model.retargeter import RetargetedMotion
 
 
 class Scene(Transform, TimeManager):
@@ -24,14 +26,16 @@ class Scene(Transform, TimeManager):
         if cfg.add_floor:
             self.add_child(Floor())
 
-        # Add the Animated Drawings
+        # Add the Animated Drawings. Characters using the same motion share its retargeting results, but only within this scene
+        motion_cache: Dict[str, RetargetedMotion] = {}
         for each in cfg.animated_characters:
 
-            ad = AnimatedDrawing(*each)
+            ad = AnimatedDrawing(*each, cache_deformations=cfg.cache_ad_deformations, disk_cache_dir=cfg.ad_disk_cache_dir,
+                                 motion_cache=motion_cache)
             self.add_child(ad)
 
-            # add bvh to the scene if we're going to visualize it
-            if cfg.add_ad_retarget_bvh:
+            # add bvh to the scene if we're going to visualize it. Characters sharing a motion share its bvh, so add it only once
+            if cfg.add_ad_retarget_bvh and ad.retargeter.bvh not in self.get_children():
                 self.add_child(ad.retargeter.bvh)
 
     def progress_time(self, delta_t: float) -> None:
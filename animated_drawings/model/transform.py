@@ -8,7 +8,7 @@ import numpy.typing as npt
 from animated_drawings.model.vectors import Vectors
 from animated_drawings.model.quaternions import Quaternions
 import logging
-from typing import Union, Optional, List, Tuple
+from typing import Union, Optional, List, Tuple, Dict
 
 
 class Transform():
@@ -24,33 +24,59 @@ class Transform():
 
         super().__init__(**kwargs)
 
+        # maps names to the first matching transform within this subtree. Built lazily, cleared when the subtree changes
+        self._name_index: Optional[Dict[str, Transform]] = None
+
         self._parent: Optional[Transform] = parent
 
+        self._dirty_bit: bool = True  # are world/local transforms stale?
+        self._subtree_dirty_bit: bool = False  # is any descendant's dirty bit set?
+
         self._children: List[Transform] = []
         for child in children:
             self.add_child(child)
 
-        self.name: Optional[str] = name
+        self._name: Optional[str] = None
+        self.name = name
 
         self._translate_m: npt.NDArray[np.float32] = np.identity(4, dtype=np.float32)
         self._rotate_m: npt.NDArray[np.float32] = np.identity(4, dtype=np.float32)
         self._scale_m: npt.NDArray[np.float32] = np.identity(4, dtype=np.float32)
+        # note: the matrices above are modified in place, as they may be views into arrays shared with other transforms (see BVH_Skeleton)
 
         if offset is not None:
             self.offset(offset)
 
         self._local_transform: npt.NDArray[np.float32] = np.identity(4, dtype=np.float32)
         self._world_transform: npt.NDArray[np.float32] = np.identity(4, dtype=np.float32)
-        self.dirty_bit: bool = True  # are world/local transforms stale?
+        self.dirty_bit = True
+
+    @property
+    def dirty_bit(self) -> bool:
+        """ Are world/local transforms stale? """
+        return self._dirty_bit
+
+    @dirty_bit.setter
+    def dirty_bit(self, dirty_bit: bool) -> None:
+        self._dirty_bit = dirty_bit
+        if not dirty_bit:
+            return
+
+        # let ancestors know this subtree needs updating. If an ancestor already knows, so do all of its ancestors
+        ancestor: Optional[Transform] = self._parent
+        while ancestor is not None and not ancestor._subtree_dirty_bit:
+            ancestor._subtree_dirty_bit = True
+            ancestor = ancestor._parent
 
     def update_transforms(self, parent_dirty_bit: bool = False, recurse_on_children: bool = True, update_ancestors: bool = False) -> None:
         """
         Updates transforms if stale.
         If own dirty bit is set, recompute local matrix
         If own or parent's dirty bit is set, recompute world matrix
-        If own or parent's dirty bit is set, recurses on children, unless param recurse_on_children is false.
+        If own or parent's dirty bit is set, or a descendant's is, visits children, unless param recurse_on_children is false.
         If update_ancestors is true, first find first ancestor, then call update_transforms upon it.
         Set dirty bit back to false.
+        Clean subtrees are skipped entirely, and the hierarchy is traversed iteratively, parents before children.
         """
         if update_ancestors:
             ancestor, ancestor_parent = self, self.get_parent()
@@ -58,16 +84,20 @@ class Transform():
                 ancestor, ancestor_parent = ancestor_parent, ancestor_parent.get_parent()
             ancestor.update_transforms()
 
-        if self.dirty_bit:
-            self.compute_local_transform()
-        if self.dirty_bit | parent_dirty_bit:
-            self.compute_world_transform()
+        stack: List[Tuple[Transform, bool]] = [(self, parent_dirty_bit)]
+        while stack:
+            t, t_parent_dirty_bit = stack.pop()
 
-        if recurse_on_children:
-            for c in self.get_children():
-                c.update_transforms(self.dirty_bit | parent_dirty_bit)
+            if t._dirty_bit:
+                t.compute_local_transform()
+            world_dirty_bit = t._dirty_bit | t_parent_dirty_bit
+            if world_dirty_bit:
+                t.compute_world_transform()
+            t._dirty_bit = False
 
-        self.dirty_bit = False
+            if (t is not self or recurse_on_children) and (world_dirty_bit or t._subtree_dirty_bit):
+                stack.extend((c, world_dirty_bit) for c in reversed(t.get_children()))
+                t._subtree_dirty_bit = False
 
     def compute_local_transform(self) -> None:
         self._local_transform = self._translate_m @ self._rotate_m @ self._scale_m
@@ -77,14 +107,15 @@ class Transform():
         if self._parent:
             self._world_transform = self._parent._world_transform @ self._world_transform
 
-    def get_world_transform(self, update_ancestors: bool = True) -> npt.NDArray[np.float32]:
+    def get_world_transform(self, update_ancestors: bool = True, copy: bool = True) -> npt.NDArray[np.float32]:
         """
         Get the transform's world matrix.
         If update is true, check to ensure the world_transform is current
+        If copy is false, the internal matrix is returned. Callers must not modify it.
         """
         if update_ancestors:
             self.update_transforms(update_ancestors=True)
-        return np.copy(self._world_transform)
+        return np.copy(self._world_transform) if copy else self._world_transform
 
     def set_scale(self, scale: float) -> None:
         self._scale_m[:-1, :-1] = scale * np.identity(3, dtype=np.float32)
@@ -113,16 +144,17 @@ class Transform():
             self.compute_local_transform()
         return np.copy(self._local_transform[:-1, -1])
 
-    def get_world_position(self, update_ancestors: bool = True) -> npt.NDArray[np.float32]:
+    def get_world_position(self, update_ancestors: bool = True, copy: bool = True) -> npt.NDArray[np.float32]:
         """
         Ensure all parent transforms are update and return world xyz coordinates
         If update_ancestor_transforms is true, update ancestor transforms to ensure
         up-to-date world_transform before returning
+        If copy is false, a view of the internal matrix is returned. Callers must not modify it.
         """
         if update_ancestors:
             self.update_transforms(update_ancestors=True)
 
-        return np.copy(self._world_transform[:-1, -1])
+        return np.copy(self._world_transform[:-1, -1]) if copy else self._world_transform[:-1, -1]
 
     def offset(self, pos: Union[npt.NDArray[np.float32], Vectors]) -> None:
         """ Translational offset by the specified amount """
@@ -164,7 +196,7 @@ class Transform():
         rotate_m[:-1, 1] = np.squeeze(up.vs)
         rotate_m[:-1, 2] = np.squeeze(fwd.vs)
 
-        self._rotate_m = rotate_m
+        self._rotate_m[:] = rotate_m
         self.dirty_bit = True
 
     def get_right_up_fwd_vectors(self) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.float32], npt.NDArray[np.float32]]:
@@ -180,7 +212,20 @@ class Transform():
             msg = f'set_rotate q must have dimension (1, 4). Found: {q.qs.shape}'
             logging.critical(msg)
             assert False, msg
-        self._rotate_m = q.to_rotation_matrix()
+        q.to_rotation_matrix(out=self._rotate_m)
+        self.dirty_bit = True
+
+    def get_rotation_matrix(self) -> npt.NDArray[np.float32]:
+        """ Returns a copy of the transform's 4x4 rotation matrix """
+        return np.copy(self._rotate_m)
+
+    def set_rotation_matrix(self, rotate_m: npt.NDArray[np.float32]) -> None:
+        """ Set the transform's rotation directly from a 4x4 rotation matrix, such as one returned by get_rotation_matrix() """
+        if rotate_m.shape != (4, 4):
+            msg = f'set_rotation_matrix rotate_m must have dimension (4, 4). Found: {rotate_m.shape}'
+            logging.critical(msg)
+            assert False, msg
+        self._rotate_m[:] = rotate_m
         self.dirty_bit = True
 
     def rotation_offset(self, q: Quaternions) -> None:
@@ -188,7 +233,7 @@ class Transform():
             msg = f'set_rotate q must have dimension (1, 4). Found: {q.qs.shape}'
             logging.critical(msg)
             assert False, msg
-        self._rotate_m = (q * Quaternions.from_rotation_matrix(self._rotate_m)).to_rotation_matrix()
+        (q * Quaternions.from_rotation_matrix(self._rotate_m)).to_rotation_matrix(out=self._rotate_m)
         self.dirty_bit = True
 
     def add_child(self, child: Transform) -> None:
@@ -199,27 +244,45 @@ class Transform():
         return self._children
 
     def set_parent(self, parent: Transform) -> None:
+        # subtrees of both the old and new ancestors change
+        if self._parent is not None:
+            self._parent._invalidate_name_index()
         self._parent = parent
+        self._parent._invalidate_name_index()
         self.dirty_bit = True
 
     def get_parent(self) -> Optional[Transform]:
         return self._parent
 
-    def get_transform_by_name(self, name: str) -> Optional[Transform]:
-        """ Search self and children for transform with matching name. Return it if found, None otherwise. """
-
-        # are we match?
-        if self.name == name:
-            return self
+    @property
+    def name(self) -> Optional[str]:
+        return self._name
 
-        # recurse to check if a child is match
-        for c in self.get_children():
-            transform_or_none = c.get_transform_by_name(name)
-            if transform_or_none:  # if we found it
-                return transform_or_none
+    @name.setter
+    def name(self, name: Optional[str]) -> None:
+        self._name = name
+        self._invalidate_name_index()
 
-        # no match
-        return None
+    def get_transform_by_name(self, name: str) -> Optional[Transform]:
+        """ Search self and children for transform with matching name. Return it if found, None otherwise. """
+        if self._name_index is None:
+            # depth-first, so the first match is the same one a recursive search would find
+            self._name_index = {}
+            stack: List[Transform] = [self]
+            while stack:
+                t = stack.pop()
+                if t.name is not None:
+                    self._name_index.setdefault(t.name, t)
+                stack.extend(reversed(t.get_children()))
+
+        return self._name_index.get(name)
+
+    def _invalidate_name_index(self) -> None:
+        """ Clear the name index of this transform and all of its ancestors """
+        t: Optional[Transform] = self
+        while t is not None:
+            t._name_index = None
+            t = t._parent
 
     def draw(self, recurse: bool = True, **kwargs) -> None:
         """ Draw this transform and recurse on children """
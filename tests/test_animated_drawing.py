@@ -2,6 +2,7 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import numpy as np
 from animated_drawings.model.animated_drawing import AnimatedDrawing
 from animated_drawings.config import Config
 from pkg_resources import resource_filename
@@ -25,3 +26,126 @@ def test_init():
     AnimatedDrawing(char_cfg, retarget_cfg, motion_cfg)
 
     assert True
+
+
+def test_deformation_cache():
+    mvc_cfg_fn = resource_filename(__name__, 'test_animated_drawing_files/test_mvc.yaml')
+    mvc_config = Config(mvc_cfg_fn)
+    char_cfg, retarget_cfg, motion_cfg = mvc_config.scene.animated_characters[0]
+
+    ad = AnimatedDrawing(char_cfg, retarget_cfg, motion_cfg, cache_deformations=True)
+
+    # first visit to a frame computes it, second visit restores it from the cache
+    ad.set_time(5 * ad.retargeter.frame_time)
+    ad.update()
+    vertices, indices = ad.vertices.copy(), ad.indices.copy()
+    joint_positions = ad.rig.get_joints_2D_positions()
+
+    ad.set_time(0.0)
+    ad.update()
+    ad.set_time(5 * ad.retargeter.frame_time)
+    ad.update()
+
+    assert 5 in ad.frame_cache
+    assert np.array_equal(ad.vertices, vertices)
+    assert np.array_equal(ad.indices, indices)
+    assert np.allclose(ad.rig.get_joints_2D_positions(), joint_positions)
+
+
+def test_disk_cache(tmp_path):
+    mvc_cfg_fn = resource_filename(__name__, 'test_animated_drawing_files/test_mvc.yaml')
+
+    # first creation computes every frame and writes the cache...
+    char_cfg, retarget_cfg, motion_cfg = Config(mvc_cfg_fn).scene.animated_characters[0]
+    ad1 = AnimatedDrawing(char_cfg, retarget_cfg, motion_cfg, disk_cache_dir=str(tmp_path))
+    assert ad1.disk_cache_p is not None and ad1.disk_cache_p.exists()
+
+    # ... and second creation loads it
+    char_cfg, retarget_cfg, motion_cfg = Config(mvc_cfg_fn).scene.animated_characters[0]
+    ad2 = AnimatedDrawing(char_cfg, retarget_cfg, motion_cfg, disk_cache_dir=str(tmp_path))
+    assert ad2.disk_cache_p == ad1.disk_cache_p
+    assert ad2.frame_cache is not None and len(ad2.frame_cache) == ad2.retargeter.frame_max_num
+
+    # ... without loading the BVH or building the ARAP solver
+    assert ad2.retargeter._bvh is None
+    assert ad2._arap is None
+
+    # results should match those of an uncached AnimatedDrawing
+    char_cfg, retarget_cfg, motion_cfg = Config(mvc_cfg_fn).scene.animated_characters[0]
+    ad3 = AnimatedDrawing(char_cfg, retarget_cfg, motion_cfg)
+    for frame_idx in [0, 7, 20]:
+        for ad in [ad2, ad3]:
+            ad.set_time(frame_idx * ad.retargeter.frame_time)
+            ad.update()
+        assert np.allclose(ad2.vertices[:, :3], ad3.vertices[:, :3], atol=1e-5)
+        assert np.array_equal(ad2.indices, ad3.indices)
+        assert np.array_equal(ad2.retargeter.get_retargeted_frame_data(frame_idx * ad2.retargeter.frame_time)[1],
+                              ad3.retargeter.get_retargeted_frame_data(frame_idx * ad3.retargeter.frame_time)[1], equal_nan=True)
+    assert ad2.retargeter._bvh is None
+
+
+def test_distance_transform_segmentation():
+    mvc_cfg_fn = resource_filename(__name__, 'test_animated_drawing_files/test_mvc.yaml')
+    char_cfg, retarget_cfg, motion_cfg = Config(mvc_cfg_fn).scene.animated_characters[0]
+    char_cfg.joint_segmentation_method = 'distance_transform'
+
+    ad = AnimatedDrawing(char_cfg, retarget_cfg, motion_cfg)
+
+    # every triangle is assigned to exactly one joint
+    tri_count = sum(len(v_idxs) for v_idxs in ad.joint_to_tri_v_idx.values()) // 3
+    assert tri_count == len(ad.mesh['triangles'])
+
+
+def test_retargeted_frame_data():
+    mvc_cfg_fn = resource_filename(__name__, 'test_animated_drawing_files/test_mvc.yaml')
+    char_cfg, retarget_cfg, motion_cfg = Config(mvc_cfg_fn).scene.animated_characters[0]
+
+    ad = AnimatedDrawing(char_cfg, retarget_cfg, motion_cfg)
+    retargeter = ad.retargeter
+
+    # per-frame data are rows of the precomputed tables, ordered by rig and bvh joints
+    orientations, joint_depths, _ = retargeter.get_retargeted_frame_data(3 * retargeter.frame_time)
+    assert orientations.base is retargeter.char_joint_orientations
+    assert joint_depths.base is retargeter.bvh_joint_depths
+    for joint_idx, joint_name in enumerate(ad.rig.joint_names):
+        if joint_name in retargeter.char_joint_to_orientation:
+            assert orientations[joint_idx] == retargeter.char_joint_to_orientation[joint_name][3]
+        else:
+            assert np.isnan(orientations[joint_idx])
+    for joint_name, depths in retargeter.bvh_joint_to_projection_depth.items():
+        assert joint_depths[retargeter.bvh_joint_names.index(joint_name)] == depths[3]
+
+
+def test_shared_retargeted_motion(tmp_path):
+    import os
+    import shutil
+    from animated_drawings.model.retargeter import Retargeter
+    mvc_cfg_fn = resource_filename(__name__, 'test_animated_drawing_files/test_mvc.yaml')
+
+    # characters sharing a motion cache and using the same motion share its character-independent retargeting results
+    motion_cache = {}
+    char_cfg, retarget_cfg, motion_cfg = Config(mvc_cfg_fn).scene.animated_characters[0]
+    ad1 = AnimatedDrawing(char_cfg, retarget_cfg, motion_cfg, motion_cache=motion_cache)
+    char_cfg, retarget_cfg, motion_cfg = Config(mvc_cfg_fn).scene.animated_characters[0]
+    ad2 = AnimatedDrawing(char_cfg, retarget_cfg, motion_cfg, motion_cache=motion_cache)
+    assert ad2.retargeter.bvh is ad1.retargeter.bvh
+    assert ad2.retargeter.joint_positions is ad1.retargeter.joint_positions
+
+    # a modified motion file is not mistaken for the original
+    bvh_p = tmp_path / motion_cfg.bvh_p.name
+    shutil.copy(motion_cfg.bvh_p, bvh_p)
+    motion_cfg.bvh_p = bvh_p
+    key = Retargeter._get_motion_cache_key(motion_cfg, retarget_cfg)
+    os.utime(bvh_p, ns=(0, 0))
+    assert Retargeter._get_motion_cache_key(motion_cfg, retarget_cfg) != key
+
+    # results should match those computed without the shared motion
+    char_cfg, retarget_cfg, motion_cfg = Config(mvc_cfg_fn).scene.animated_characters[0]
+    ad3 = AnimatedDrawing(char_cfg, retarget_cfg, motion_cfg)
+    assert ad3.retargeter.bvh is not ad1.retargeter.bvh
+    for frame_idx in [0, 7, 20]:
+        for ad in [ad2, ad3]:
+            ad.set_time(frame_idx * ad.retargeter.frame_time)
+            ad.update()
+        assert np.array_equal(ad2.vertices[:, :3], ad3.vertices[:, :3])
+        assert np.array_equal(ad2.indices, ad3.indices)
@@ -114,3 +114,31 @@ def test_four_triangle_mesh():
         [1.46633111e+00, 2.60720416e+00],
         [2.82413859e+00, 2.62209072e+00]
     ])).all()
+
+
+def test_solve_batch():
+    vertices = np.array([
+        [1.0, 0.0],
+        [1.0, 1.0],
+        [2.0, 1.0],
+        [2.0, 0.0],
+    ])
+
+    triangles = np.array([
+        [0, 1, 2],
+        [0, 2, 3],
+    ], np.int32)
+
+    pins_xy = np.array([[1.0, 0.0], [2.0, 0.0]])
+    arap = ARAP(pins_xy, triangles=triangles, vertices=vertices)
+
+    frames_pins_xy = np.array([
+        [[1.0, 0.0], [1.7, 0.7]],
+        [[1.0, 0.0], [2.0, 0.0]],
+        [[-5.0, 0.0], [5.0, 0.0]],
+    ])
+    v = arap.solve_batch(frames_pins_xy)
+
+    assert v.shape == (3, 4, 2)
+    for frame_pins_xy, frame_v in zip(frames_pins_xy, v):
+        assert np.isclose(frame_v, arap.solve(frame_pins_xy)).all()
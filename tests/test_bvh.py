@@ -2,6 +2,8 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import numpy as np
+import pytest
 from animated_drawings.model.bvh import BVH
 from pkg_resources import resource_filename
 
@@ -30,3 +32,92 @@ def test_bvh_from_file():
     assert b.rot_data.shape[1] == b.root_joint.joint_count()
     # and the rotation is a quaternion with dimensionality of 4
     assert b.rot_data.shape[-1] == 4
+
+
+def test_bvh_from_file_frame_range():
+    bvh_fn = resource_filename(__name__, 'test_bvh_files/zombie.bvh')
+    b_full = BVH.from_file(bvh_fn)
+    b = BVH.from_file(bvh_fn, start_frame_idx=10, end_frame_idx=50)
+
+    # only frames within the range should be kept
+    assert b.frame_max_num == 40
+    assert b.pos_data.shape[0] == b.rot_data.shape[0] == 40
+    assert (b.pos_data == b_full.pos_data[10:50]).all()
+    assert (b.rot_data == b_full.rot_data[10:50]).all()
+
+
+def test_bvh_from_file_truncated(tmp_path):
+    bvh_fn = resource_filename(__name__, 'test_bvh_files/zombie.bvh')
+    with open(bvh_fn, 'r') as f:
+        lines = f.readlines()
+
+    # file ending right after the root's OFFSET should fail with a parse error, not an IndexError
+    truncated_fn = tmp_path / 'truncated.bvh'
+    truncated_fn.write_text(''.join(lines[:4]))
+    with pytest.raises(AssertionError, match='Malformed BVH'):
+        BVH.from_file(str(truncated_fn))
+
+
+def test_bvh_compile(tmp_path):
+    bvh_fn = resource_filename(__name__, 'test_bvh_files/zombie.bvh')
+    b = BVH.from_file(bvh_fn)
+
+    compiled_fn = str(tmp_path / 'zombie.bvhc')
+    b.compile(compiled_fn)
+
+    for mmap in [True, False]:
+        c = BVH.from_compiled(compiled_fn, mmap=mmap)
+        assert c.name == b.name
+        assert c.frame_time == b.frame_time
+        assert c.frame_max_num == b.frame_max_num
+        assert c.get_joint_names() == b.get_joint_names()
+        assert (c.pos_data == b.pos_data).all()
+        assert (c.rot_data == b.rot_data).all()
+
+    # frame range is applied when loading
+    c = BVH.from_compiled(compiled_fn, start_frame_idx=10, end_frame_idx=50)
+    assert c.frame_max_num == 40
+    assert (c.rot_data == b.rot_data[10:50]).all()
+
+    # posed skeletons should match
+    b.apply_frame(20)
+    c.apply_frame(10)
+    assert np.allclose(b.root_joint.get_chain_worldspace_positions(), c.root_joint.get_chain_worldspace_positions())
+
+
+def test_bvh_compute_world_positions():
+    bvh_fn = resource_filename(__name__, 'test_bvh_files/zombie.bvh')
+    b = BVH.from_file(bvh_fn, end_frame_idx=20)
+
+    world_positions = b.compute_world_positions()
+    assert world_positions.shape == (20, b.joint_num, 3)
+
+    # should match frame-by-frame forward kinematics
+    for frame_idx in [0, 7, 19]:
+        b.apply_frame(frame_idx)
+        positions = np.array(b.root_joint.get_chain_worldspace_positions()).reshape([-1, 3])
+        assert np.allclose(world_positions[frame_idx], positions, atol=1e-4)
+
+
+def test_bvh_skeleton():
+    bvh_fn = resource_filename(__name__, 'test_bvh_files/zombie.bvh')
+    b = BVH.from_file(bvh_fn)
+    skeleton = b.skeleton
+
+    assert skeleton.joint_num == b.root_joint.joint_count()
+    assert skeleton.joint_names == b.root_joint.get_chain_joint_names()
+
+    # parents precede their children
+    assert skeleton.parent_idxs[0] == -1
+    for joint_idx, joint in enumerate(skeleton.joints[1:], start=1):
+        assert skeleton.joints[skeleton.parent_idxs[joint_idx]] is joint.get_parent()
+
+    # name lookups match searching the tree
+    for joint_name in skeleton.joint_names:
+        assert skeleton.get_joint_by_name(joint_name) is b.root_joint.get_transform_by_name(joint_name)
+    assert skeleton.get_joint_by_name('not a joint') is None
+
+    # joints' matrices are views into the skeleton's arrays
+    b.apply_frame(10)
+    for joint_idx, joint in enumerate(skeleton.joints):
+        assert np.array_equal(joint.get_rotation_matrix(), skeleton.rotate_ms[joint_idx])
@@ -49,6 +49,33 @@ def test_to_rotation_matrix():
         [0.000000e+00,  0.000000e+00,  0.000000e+00,  1.000000e+00]]))
 
 
+def test_to_rotation_matrices():
+    angles = np.array([[np.pi / 2], [0.3], [-2.0]])
+    axes = Vectors(np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [1.0, 1.0, 1.0]]))
+    qs = Quaternions.from_angle_axis(angles, axes)
+    ms = qs.to_rotation_matrices()
+    assert ms.shape == (3, 4, 4)
+    for idx in range(3):
+        assert np.allclose(ms[idx], Quaternions(qs.qs[idx]).to_rotation_matrix())
+
+
+def test_to_rotation_matrix_out():
+    q = Quaternions.from_angle_axis(np.array([[0.7]]), Vectors(np.array([1.0, 2.0, 3.0])))
+    out = np.full([4, 4], np.nan, dtype=np.float32)
+    ret = q.to_rotation_matrix(out=out)
+    assert ret is out
+    assert np.array_equal(out, q.to_rotation_matrix())
+
+    # constructing without normalization shares the array
+    qs = np.array([[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0]])
+    q2 = Quaternions(qs, normalize=False)
+    assert q2.qs is qs
+    outs = np.zeros([2, 4, 4], dtype=np.float32)
+    q2.to_rotation_matrices(out=outs)
+    assert np.array_equal(outs[0], np.identity(4))
+    assert np.array_equal(outs[1], np.diag([1.0, -1.0, -1.0, 1.0]))
+
+
 def test_from_rotation_matrix():
     angles = np.array([[np.pi / 2]])
     axis = np.array([1.0, 1.0, 0.0], dtype=np.float32)
@@ -57,11 +84,56 @@ def test_from_rotation_matrix():
     assert np.allclose(q1.qs, q2.qs)
 
 
+def test_from_rotation_matrices():
+    qs = Quaternions(np.random.uniform(-1.0, 1.0, [20, 4]))
+    ms = qs.to_rotation_matrices()
+
+    # q and -q represent the same rotation
+    q2s = Quaternions.from_rotation_matrices(ms)
+    assert np.allclose(np.abs(np.sum(qs.qs * q2s.qs, axis=-1)), 1.0, atol=1e-5)
+    for idx in range(20):
+        assert np.allclose(q2s.qs[idx], Quaternions.from_rotation_matrix(ms[idx]).qs, atol=1e-5)
+
+    # 3x3 matrices are accepted as well
+    assert np.allclose(Quaternions.from_rotation_matrices(ms[:, :3, :3]).qs, q2s.qs)
+
+
+def test_slerp_nlerp():
+    axis = Vectors(np.array([0.0, 0.0, 1.0]))
+    q0 = Quaternions.from_angle_axis(np.array([[0.0]]), axis)
+    q1 = Quaternions.from_angle_axis(np.array([[np.pi / 2]]), axis)
+
+    ts = np.array([0.0, 0.25, 0.5, 1.0])
+    qs = Quaternions.slerp(q0, q1, ts)
+    for t, q in zip(ts, qs.qs):
+        expected = Quaternions.from_angle_axis(np.array([[t * np.pi / 2]]), axis)
+        assert np.allclose(q, expected.qs)
+
+    # nlerp follows the same path, but not at constant speed
+    assert np.allclose(Quaternions.nlerp(q0, q1, 0.5).qs, qs.qs[2])
+    assert np.allclose(Quaternions.nlerp(q0, q1, 1.0).qs, q1.qs)
+
+    # q and -q are the same rotation, and interpolation takes the shorter arc
+    assert np.allclose(Quaternions.slerp(q0, Quaternions(-q1.qs), 0.5).qs, qs.qs[2])
+
+
 def test_to_euler_angles():
     # TODO add test coverage for from_euler_angles
     pass
 
 
+def test_from_euler_angles_batch():
+    orders = ['zxy', 'xyz', 'zxy', '', 'yz']
+    angles = np.random.uniform(-180.0, 180.0, [10, len(orders), 3]).astype(np.float32)
+    qs = Quaternions.from_euler_angles_batch(orders, angles)
+    assert qs.qs.shape == (10, len(orders), 4)
+
+    # should match converting each joint separately
+    for joint_idx, order in enumerate(orders):
+        q = Quaternions.from_euler_angles(order, angles[:, joint_idx, :len(order)])
+        assert np.allclose(qs.qs[:, joint_idx], q.qs, atol=1e-6)
+
+
 def test_multiply():
     # TODO add test coverage for quaternion multiplication
     pass
@@ -67,3 +67,50 @@ def test_look_at():
     m[0, 0] = -1.0
     m[2, 2] = -1.0
     assert np.isclose(t._local_transform, m).all()
+
+
+def test_get_transform_by_name():
+    t1 = Transform(name='t1')
+    t2 = Transform(name='t2')
+    t1.add_child(t2)
+    assert t1.get_transform_by_name('t2') is t2
+    assert t1.get_transform_by_name('t3') is None
+
+    # index is updated when the tree changes...
+    t3 = Transform(name='t3')
+    t2.add_child(t3)
+    assert t1.get_transform_by_name('t3') is t3
+
+    # ... or a transform is renamed
+    t3.name = 't4'
+    assert t1.get_transform_by_name('t3') is None
+    assert t1.get_transform_by_name('t4') is t3
+
+    # with duplicate names, the first found depth-first is returned
+    t5 = Transform(name='t2')
+    t1.add_child(t5)
+    assert t1.get_transform_by_name('t2') is t2
+
+
+def test_update_transforms_skips_clean_subtrees():
+    root, a, b, a_child = Transform(), Transform(), Transform(), Transform()
+    root.add_child(a)
+    root.add_child(b)
+    a.add_child(a_child)
+    root.update_transforms()
+
+    # count world transform computations per transform
+    computed = []
+    for t in [root, a, b, a_child]:
+        t.compute_world_transform = (lambda t=t, f=t.compute_world_transform: (computed.append(t), f())[1])
+
+    a_child.set_position(np.array([1.0, 0.0, 0.0]))
+    root.update_transforms()
+    assert computed == [a_child]
+    assert np.array_equal(a_child.get_world_position(), [1.0, 0.0, 0.0])
+
+    # changes to a parent propagate to its children, but not its siblings
+    computed.clear()
+    a.set_position(np.array([0.0, 2.0, 0.0]))
+    assert np.array_equal(a_child.get_world_position(), [1.0, 2.0, 0.0])
+    assert computed == [a, a_child]
@@ -0,0 +1,81 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from types import SimpleNamespace
+import numpy as np
+import numpy.typing as npt
+import pytest
+from PIL import Image, ImageSequence
+from animated_drawings.config import ControllerConfig
+from animated_drawings.controller.video_render_controller import VideoWriter, ThreadedVideoWriter, GIFWriter
+
+
+class _FailingWriter(VideoWriter):
+    """ Raises on the third frame. Records whether cleanup() was called. """
+
+    def __init__(self) -> None:
+        self.frame_count = 0
+        self.cleaned_up = False
+
+    def process_frame(self, frame: npt.NDArray[np.uint8]) -> None:
+        self.frame_count += 1
+        if self.frame_count == 3:
+            raise ValueError('boom')
+
+    def cleanup(self) -> None:
+        self.cleaned_up = True
+
+
+def test_threaded_video_writer_error():
+    failing_writer = _FailingWriter()
+    video_writer = ThreadedVideoWriter(failing_writer, 8, 4)
+
+    # frames after the error are discarded rather than raising on the render thread
+    for _ in range(10):
+        video_writer.process_frame(np.zeros([4, 8, 4], dtype=np.uint8))
+
+    with pytest.raises(AssertionError, match='Error encoding video frame: boom'):
+        video_writer.cleanup()
+    assert video_writer.has_failed()
+    assert failing_writer.cleaned_up
+    assert failing_writer.frame_count == 3
+
+
+def _make_bgra_frame(frame_idx: int) -> npt.NDArray[np.uint8]:
+    """ Transparent frame containing a red and an orange rectangle that move with frame_idx. Frame 2 is fully transparent. """
+    frame = np.zeros([48, 64, 4], dtype=np.uint8)
+    if frame_idx != 2:
+        frame[5 + frame_idx:20 + frame_idx, 10:30] = [0, 0, 255, 255]
+        frame[30:40, 2 * frame_idx:20 + 2 * frame_idx] = [0, 128, 255, 255]
+    return frame
+
+
+@pytest.mark.parametrize('palette_sample_frames', [0, 3])
+def test_gif_writer(tmp_path, palette_sample_frames):
+    output_p = tmp_path / 'video.gif'
+    cfg = ControllerConfig({
+        'MODE': 'video_render',
+        'KEYBOARD_TIMESTEP': 0.0333,
+        'OUTPUT_VIDEO_PATH': str(output_p),
+        'OUTPUT_VIDEO_CODEC': 'avc1',
+        'OUTPUT_GIF_PALETTE_SAMPLE_FRAMES': palette_sample_frames,
+    })
+    controller = SimpleNamespace(cfg=cfg, delta_t=0.05, video_width=64, video_height=48)
+
+    frames = [_make_bgra_frame(frame_idx) for frame_idx in range(6)]
+    video_writer = ThreadedVideoWriter(GIFWriter(controller), 64, 48)  # pyright: ignore[reportGeneralTypeIssues]
+    for frame in frames:
+        video_writer.process_frame(frame)
+    video_writer.cleanup()
+
+    with Image.open(output_p) as im:
+        assert im.info['loop'] == 0
+        assert im.info['duration'] == 50
+        gif_frames = [np.array(gif_frame.convert('RGBA')) for gif_frame in ImageSequence.Iterator(im)]
+
+    assert len(gif_frames) == len(frames)
+    for frame, gif_frame in zip(frames, gif_frames):
+        opaque = frame[:, :, 3] == 255
+        assert np.array_equal(gif_frame[:, :, 3] == 255, opaque)
+        assert np.array_equal(gif_frame[opaque][:, :3], frame[opaque][:, 2::-1])